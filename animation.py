@@ -0,0 +1,192 @@
+import math
+import random
+from collections import OrderedDict
+
+
+#Easing curves map linear progress in [0, 1] to eased progress in [0, 1]
+def linear(t):
+    return t
+
+def ease_in(t):
+    return t * t
+
+def ease_out(t):
+    return 1 - (1 - t) * (1 - t)
+
+def ease_in_out(t):
+    return t * t * (3 - 2 * t)
+
+EASINGS = {
+    "linear": linear,
+    "ease_in": ease_in,
+    "ease_out": ease_out,
+    "ease_in_out": ease_in_out,
+}
+
+
+def reverse(easing):
+    #the same curve played backwards, so a tween eased with it passes through the same values in reverse order
+    easing = EASINGS[easing] if isinstance(easing, str) else easing
+    return lambda t: 1 - easing(1 - t)
+
+
+class Timeline:
+    #Values tweened between keyframes: a list of (time in seconds, {name: value}[, easing]) in time order,
+    #starting at 0. Into each keyframe every value is eased from the one before with the keyframe's easing (the
+    #timeline's by default), in `steps` quantised steps, so a timeline only ever yields a few distinct poses and
+    #the frame drawn for each can be cached (see FrameCache): a smoother tween costs more frames to draw once,
+    #not more work per frame. Values are rounded to 1/100, so tweens that pass through a pose share its frame.
+    def __init__(self, keyframes, steps=30, easing=linear):
+        self.keyframes = keyframes
+        self.duration = keyframes[-1][0]
+        self.steps = steps
+        self.easing = EASINGS[easing] if isinstance(easing, str) else easing
+
+    def finished(self, elapsed):
+        #a little slack so frame times that sum to the duration are not off by rounding
+        return elapsed >= self.duration - 1e-6
+
+    def pose(self, elapsed):
+        #the values at the last step reached; a step is shown as soon as time passes into it
+        if self.finished(elapsed):
+            return self._round(self.keyframes[-1][1])
+
+        for index, (end_time, *_) in enumerate(self.keyframes[1:]):
+            if elapsed < end_time:
+                break
+        start_time = self.keyframes[index][0]
+        step = max(math.ceil((elapsed - start_time) / (end_time - start_time) * self.steps), 0)
+
+        return self._step(index, min(step, self.steps))
+
+    def poses(self):
+        #every pose the timeline passes through in order, to draw their frames ahead of time
+        yield self._round(self.keyframes[0][1])
+        for index in range(len(self.keyframes) - 1):
+            for step in range(1, self.steps + 1):
+                yield self._step(index, step)
+
+    def _step(self, index, step):
+        #the values at a step of the tween from keyframe index to the next
+        (_, start, *_), (_, end, *easing) = self.keyframes[index:index + 2]
+        easing = (EASINGS[easing[0]] if isinstance(easing[0], str) else easing[0]) if easing else self.easing
+        progress = easing(step / self.steps)
+
+        return self._round({name: value + (end[name] - value) * progress for name, value in start.items()})
+
+    @staticmethod
+    def _round(values):
+        return {name: round(value, 2) for name, value in values.items()}
+
+
+def keyframes_via(rest, current, target, poses, durations, easings):
+    #Keyframes from the pose of `current` to that of `target` by way of the `rest` pose: back along current's own
+    #tween out of rest, then out along target's. Every transition then passes through the same steps, whose frames
+    #stay cached, where going straight from one pose to another would draw new ones for every pair of them.
+    keyframes = [(0, poses[current])]
+    time = 0
+    if current != rest and current != target:
+        time += durations[current]
+        keyframes.append((time, poses[rest], reverse(easings[current])))
+    if target != rest and target != current:
+        time += durations[target]
+        keyframes.append((time, poses[target], easings[target]))
+
+    return keyframes
+
+
+class FrameCache:
+    #Bounded LRU of the frames drawn for poses (dicts of values, see Timeline), so each pose is drawn once
+    #however often it is shown. render(pose) draws the frame of a pose that is not cached yet.
+    #maxsize None keeps every frame, which the quantised steps of a few timelines already bound.
+    def __init__(self, render, maxsize=None):
+        self.render = render
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._frames = OrderedDict()
+
+    def __len__(self):
+        return len(self._frames)
+
+    def get(self, pose):
+        key = tuple(sorted(pose.items()))
+        frame = self._frames.get(key)
+        if frame is None:
+            self.misses += 1
+            frame = self._frames[key] = self.render(pose)
+            while self.maxsize is not None and len(self._frames) > self.maxsize:
+                self._frames.popitem(last=False)
+        else:
+            self.hits += 1
+            self._frames.move_to_end(key)
+
+        return frame
+
+    def clear(self):
+        self._frames.clear()
+
+
+class IdleMotion:
+    #Precomputed, seeded track of how the eyes move while idle, shared by the eyes so they move together.
+    #Every `interval` seconds the eyes jitter by up to `jitter` pixels around a slow bob up and down, of up to
+    #max_position pixels at `velocity` pixels per second, and every saccade_interval seconds or so they glance
+    #up to saccade_distance pixels away and hold there for saccade_hold seconds. The track covers `duration`
+    #seconds and then repeats; the same seed always gives the same track, and since it is known ahead of time,
+    #so is when the eyes next move (see next_change). The distances are in pixels of the face as described;
+    #`scale` multiplies them for a face laid out at another size (see dynamic_eyes.compile_face).
+    def __init__(self, seed=0, interval=1/60, jitter=1, velocity=4, max_position=20, saccade_interval=(2, 6), saccade_hold=(0.3, 1.0), saccade_distance=12, duration=60, scale=1):
+        rng = random.Random(seed)
+        self.interval = interval
+
+        #the bob
+        self._idle_incr = 0
+        self._idle_up_flag = True
+
+        self.track = []
+        saccade = (0, 0)
+        saccade_end = 0
+        next_saccade = rng.uniform(*saccade_interval)
+        for tick in range(max(round(duration / interval), 1)):
+            time = tick * interval
+
+            self._idle_incr += velocity * interval if self._idle_up_flag else -velocity * interval
+            if abs(self._idle_incr) >= max_position:
+                self._idle_incr = math.copysign(max_position, self._idle_incr)
+                self._idle_up_flag = not self._idle_up_flag
+
+            if time >= next_saccade:
+                angle = rng.uniform(0, 2 * math.pi)
+                distance = rng.uniform(0.5, 1) * saccade_distance
+                saccade = (round(distance * math.cos(angle)), round(distance * math.sin(angle)))
+                saccade_end = time + rng.uniform(*saccade_hold)
+                next_saccade = saccade_end + rng.uniform(*saccade_interval)
+            elif time >= saccade_end:
+                saccade = (0, 0)
+
+            dx = saccade[0] + rng.randint(-jitter, jitter)
+            dy = saccade[1] + round(self._idle_incr) + rng.randint(-jitter, jitter)
+            self.track.append((round(dx * scale), round(dy * scale)))
+
+        #ticks from each tick until the offset changes, None if it never does
+        self._until_change = [None] * len(self.track)
+        if len(set(self.track)) > 1:
+            ticks = 1
+            #twice round, so the ticks at the end count on into the track repeating
+            for index in reversed(range(2 * len(self.track))):
+                tick, following = index % len(self.track), (index + 1) % len(self.track)
+                ticks = 1 if self.track[tick] != self.track[following] else ticks + 1
+                self._until_change[tick] = ticks
+
+    def offset(self, elapsed):
+        #(dx, dy) of the eyes after `elapsed` seconds of idling
+        return self.track[int(elapsed / self.interval) % len(self.track)]
+
+    def next_change(self, elapsed):
+        #seconds from `elapsed` until the offset changes, None if it never does
+        tick = int(elapsed / self.interval)
+        ticks = self._until_change[tick % len(self.track)]
+        if ticks is None:
+            return None
+
+        return (tick + ticks) * self.interval - elapsed
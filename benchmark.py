@@ -0,0 +1,233 @@
+import os
+#Render off-screen: SDL's dummy video driver needs no physical display
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+
+import sys
+import json
+import time
+import argparse
+import platform
+import subprocess
+
+import numpy as np
+import cv2
+import pygame as pg
+
+from dynamic_eyes import State, compile_face, glassy_blur
+from face import load_face
+from neon import create_neon
+from blur import BACKENDS
+from post_processing import create_post_processor, SpriteGlow
+
+STAGES = ("update", "blit", "post-process", "present", "neon")
+PERCENTILES = (50, 90, 99)
+
+
+def revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def script(eyes, mouth):
+    #Endless walk through every expression and mien: start the next one whenever the previous has finished
+    expressions = list(eyes[0].poses)
+    miens = list(mouth.poses)
+    expression_step = mien_step = 0
+    while True:
+        if all(eye.state == State.IDLE for eye in eyes):
+            for eye in eyes:
+                eye.express(expressions[expression_step % len(expressions)])
+            expression_step += 1
+        if mouth.state == State.IDLE:
+            mouth.express(miens[mien_step % len(miens)])
+            mien_step += 1
+
+        yield
+
+
+def summarise(times):
+    times = np.asarray(times)
+    summary = {f"p{p}": round(float(np.percentile(times, p)), 3) for p in PERCENTILES}
+    summary["mean"] = round(float(times.mean()), 3)
+    summary["max"] = round(float(times.max()), 3)
+
+    return summary
+
+
+def run(resolution, frames, post, settings, neon=True, workers=1):
+    width, height = resolution
+    screen = pg.display.set_mode(resolution)
+
+    #the dynamic_eyes face, scaled from the 1920x1080 it was designed for, and its glow scaled with it as
+    #dynamic_eyes.main does, so the glow timed is the one the app draws at this resolution
+    description = load_face()
+    face = compile_face(description, (width, height))
+    glow_scale = height / description["size"][1]
+    settings = dict(settings, radius=max(round(16 * glow_scale), 1), strength=20 * glow_scale)
+    sprites, eyes, mouth = face.sprites, face.eyes, face.mouth
+    sprite_glow = None
+    if post == "glassy_blur":
+        post_processor = None
+    elif post == "sprite":
+        #glows are made per sprite frame during the blit, so there is nothing left to post-process
+        post_processor = None
+        sprite_glow = SpriteGlow(create_post_processor(post="blur", **settings))
+    elif post == "blur_full":
+        post_processor = create_post_processor(post="blur", **settings)
+    elif post == "tiled":
+        post_processor = create_post_processor(post="blur", workers=workers, **settings)
+    else:
+        post_processor = create_post_processor(post=None if post == "none" else post, **settings)
+    steps = script(eyes, mouth)
+
+    times = {stage: [] for stage in STAGES if neon or stage != "neon"}
+    dt = 1 / 60
+    for _ in range(frames):
+        next(steps)
+
+        start = time.perf_counter()
+        for sprite in sprites:
+            sprite.update(dt)
+        after_update = time.perf_counter()
+
+        screen.fill((0, 0, 0))
+        if sprite_glow is None:
+            sprites.draw(screen)
+        else:
+            sprites.draw(screen, lambda sprite: (sprite_glow.glow(sprite.image), sprite.rect.move(-sprite_glow.reach, -sprite_glow.reach), None, pg.BLEND_ADD))
+        after_blit = time.perf_counter()
+
+        if neon:
+            #create_neon is timed on the same composite but is not part of the frame; the composite changes every
+            #frame, so without a cache, which would only add a hash and a miss
+            create_neon(screen, cache=None)
+        after_neon = time.perf_counter()
+
+        if post == "glassy_blur":
+            blurred_screen = glassy_blur(screen)
+        elif post == "blur_full":
+            #without the sprites, the whole frame is processed
+            blurred_screen = post_processor.apply(screen)
+        elif post_processor is not None:
+            blurred_screen = post_processor.apply(screen, sprites=sprites)
+        else:
+            blurred_screen = None
+        after_post = time.perf_counter()
+
+        if blurred_screen is not None:
+            screen.blit(blurred_screen, blurred_screen.get_rect(center = screen.get_rect().center), special_flags = pg.BLEND_PREMULTIPLIED)
+        pg.display.update()
+        after_present = time.perf_counter()
+
+        times["update"].append(1000 * (after_update - start))
+        times["blit"].append(1000 * (after_blit - after_update))
+        if neon:
+            times["neon"].append(1000 * (after_neon - after_blit))
+        times["post-process"].append(1000 * (after_post - after_neon))
+        times["present"].append(1000 * (after_present - after_post))
+
+    return {
+        "resolution": list(resolution),
+        "post": post,
+        "workers": workers,
+        "stages": {stage: summarise(stage_times) for stage, stage_times in times.items()},
+    }
+
+
+def compare(results, baseline):
+    #print the p50 of each stage against a previous run, matched by resolution and post-processing
+    previous = {(tuple(result["resolution"]), result["post"], result.get("workers", 1)): result for result in baseline["results"]}
+    print(f"\ncompared with {baseline.get('revision')} (p50 ms, new / old):")
+    for result in results["results"]:
+        old = previous.get((tuple(result["resolution"]), result["post"], result["workers"]))
+        if old is None:
+            continue
+
+        cells = []
+        for stage, summary in result["stages"].items():
+            if stage in old["stages"]:
+                old_p50 = old["stages"][stage]["p50"]
+                ratio = summary["p50"] / old_p50 if old_p50 else float("nan")
+                cells.append(f"{stage} {summary['p50']:.2f}/{old_p50:.2f} ({ratio:.2f}x)")
+        print(f"  {name(result)}: " + ", ".join(cells))
+
+
+def name(result):
+    width, height = result["resolution"]
+    workers = f" x{result['workers']}" if result["post"] == "tiled" else ""
+
+    return f"{width}x{height} {result['post']}{workers}"
+
+
+def scaling(results):
+    #speed-up of the tiled post-processing over its single-worker run, per resolution
+    print("\ntiled post-process scaling (p50):")
+    for resolution in dict.fromkeys(tuple(result["resolution"]) for result in results):
+        runs = [result for result in results if result["post"] == "tiled" and tuple(result["resolution"]) == resolution]
+        if not runs:
+            continue
+
+        single = runs[0]["stages"]["post-process"]["p50"]
+        print(f"  {resolution[0]}x{resolution[1]}: " + ", ".join(
+            f"{run['workers']} workers {run['stages']['post-process']['p50']:.2f} ms ({single / run['stages']['post-process']['p50']:.2f}x)" for run in runs))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Headless benchmark of the face renderer")
+    parser.add_argument("--frames", type=int, default=300, help="frames to render per resolution")
+    parser.add_argument("--resolutions", nargs="+", default=["800x480", "1280x720", "1920x1080"], help="WIDTHxHEIGHT sizes to render at")
+    parser.add_argument("--post", nargs="+", default=["glassy_blur"], choices=["glassy_blur", "blur", "blur_full", "bloom", "tiled", "sprite", "none"], help="post-processing to measure")
+    parser.add_argument("--blur", choices=BACKENDS, default="gaussian", help="blur backend for --post blur/bloom/tiled/sprite")
+    parser.add_argument("--workers", nargs="+", type=int, default=list(range(1, (os.cpu_count() or 1) + 1)), help="worker counts to run --post tiled with")
+    parser.add_argument("--opencv-threads", type=int, default=1, help="OpenCV's own thread count for --post tiled")
+    parser.add_argument("--temporal", type=int, metavar="FRAMES", help="reuse the glow of --post blur/bloom/tiled between frames, recomputing it at least every FRAMES frames")
+    parser.add_argument("--no-neon", action="store_true", help="skip timing create_neon")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--compare", help="JSON results of an earlier run to compare against")
+    args = parser.parse_args()
+
+    pg.init()
+    #tiled runs change OpenCV's thread count, the other runs get the default back
+    default_opencv_threads = cv2.getNumThreads()
+    results = {
+        "revision": revision(),
+        "machine": platform.machine(),
+        "platform": platform.platform(),
+        "python": platform.python_version(),
+        "pygame": pg.version.ver,
+        "opencv": cv2.__version__,
+        "numpy": np.__version__,
+        "frames": args.frames,
+        "results": [],
+    }
+
+    for resolution in args.resolutions:
+        width, height = (int(value) for value in resolution.lower().split("x"))
+        for post in args.post:
+            for workers in args.workers if post == "tiled" else [1]:
+                settings = dict(blur=args.blur, opencv_threads=args.opencv_threads if post == "tiled" else default_opencv_threads, temporal=args.temporal)
+                result = run((width, height), args.frames, post, settings, neon=not args.no_neon, workers=workers)
+                results["results"].append(result)
+
+                print(f"{name(result)}:")
+                for stage, summary in result["stages"].items():
+                    print(f"  {stage:<13}" + "  ".join(f"{key} {value:7.2f}" for key, value in summary.items()))
+
+    pg.quit()
+
+    if "tiled" in args.post:
+        scaling(results["results"])
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent=2)
+
+    if args.compare:
+        with open(args.compare) as file:
+            compare(results, json.load(file))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,213 @@
+import math
+from functools import cached_property
+
+import numpy as np
+import cv2
+
+#Registry of blur backends by name, filled in by the register_backend decorator
+BACKENDS = {}
+
+
+def register_backend(name):
+    def decorator(cls):
+        cls.name = name
+        BACKENDS[name] = cls
+        return cls
+
+    return decorator
+
+
+def get_backend(name, radius=16, strength=20):
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown blur backend '{name}', expected one of: {', '.join(BACKENDS)}")
+
+    return BACKENDS[name](radius=radius, strength=strength)
+
+
+class Scratch:
+    #A reusable uint8 array for images whose shape changes from call to call, like dirty regions: one flat
+    #buffer, grown to the largest image asked for so far, handed out as a C-contiguous view of the shape asked
+    #for. Once the largest size has been seen it never allocates again.
+    def __init__(self):
+        self._buffer = np.empty(0, np.uint8)
+
+    @property
+    def nbytes(self):
+        return self._buffer.nbytes
+
+    def get(self, shape):
+        size = math.prod(shape)
+        if size > self._buffer.size:
+            self._buffer = np.empty(size, np.uint8)
+
+        return self._buffer[:size].reshape(shape)
+
+
+class BlurBackend:
+    #Every backend takes the same parameters (fixed once made, so what is derived from them is worked out once):
+    #   radius   - half the kernel size in pixels (the kernel is 2*radius+1 wide), i.e. how far the glow reaches
+    #   strength - the Gaussian sigma the backend approximates
+    #max_error is the largest per-channel difference (out of 255) from the exact Gaussian with the same
+    #radius and strength, measured on the dynamic_eyes face at radius=16, strength=20
+    name = None
+    max_error = 0
+
+    def __init__(self, radius=16, strength=20):
+        self.radius = radius
+        self.strength = strength
+
+    @cached_property
+    def ksize(self):
+        return (2 * self.radius + 1, 2 * self.radius + 1)
+
+    @cached_property
+    def effective_sigma(self):
+        #the reference kernel is cut off at the radius, which for a glow is often well inside the sigma,
+        #so approximations have to match the spread of the truncated kernel rather than the sigma itself
+        kernel = cv2.getGaussianKernel(2 * self.radius + 1, self.strength).ravel()
+        offsets = np.arange(-self.radius, self.radius + 1)
+
+        return math.sqrt(np.sum(kernel * offsets ** 2))
+
+    @property
+    def reach(self):
+        #how many pixels away a source pixel can still change the output
+        return self.radius
+
+    def blur(self, src, dst):
+        #blur the uint8 image src into dst (same shape, may be the same array)
+        raise NotImplementedError
+
+
+@register_backend("gaussian")
+class GaussianBlur(BlurBackend):
+    #The reference: an exact separable Gaussian
+    max_error = 0
+
+    def blur(self, src, dst):
+        cv2.GaussianBlur(src, ksize=self.ksize, sigmaX=self.strength, sigmaY=self.strength, dst=dst)
+
+
+@register_backend("stack")
+class StackBlur(BlurBackend):
+    #Stack blur: a triangular kernel whose cost does not depend on the radius
+    max_error = 11
+
+    @cached_property
+    def stack_size(self):
+        #a stack blur of radius r is a triangle with variance r(r+2)/6
+        radius = int(round(math.sqrt(6 * self.effective_sigma ** 2 + 1) - 1))
+
+        return (2 * radius + 1, 2 * radius + 1)
+
+    @cached_property
+    def reach(self):
+        return self.stack_size[0] // 2
+
+    def __init__(self, radius=16, strength=20):
+        super().__init__(radius, strength)
+        #cv2.stackBlur ignores the row stride of dst, so regions of a larger image go through a scratch array
+        self._scratch = Scratch()
+
+    def blur(self, src, dst):
+        if dst.flags.c_contiguous:
+            cv2.stackBlur(src, ksize=self.stack_size, dst=dst)
+            return
+
+        scratch = self._scratch.get(dst.shape)
+        cv2.stackBlur(src, ksize=self.stack_size, dst=scratch)
+        np.copyto(dst, scratch)
+
+
+@register_backend("box")
+class BoxBlur(BlurBackend):
+    #Repeated box blurs converge on a Gaussian; three passes is close enough for a glow
+    max_error = 11
+    passes = 3
+
+    @cached_property
+    def box_size(self):
+        #width of a box that, applied `passes` times, has the variance of the target Gaussian
+        width = math.sqrt(12 * self.effective_sigma ** 2 / self.passes + 1)
+        #even boxes are off-centre and would shift the image, so round to the nearest odd width
+        width = 2 * int(round((width - 1) / 2)) + 1
+
+        return (width, width)
+
+    @cached_property
+    def reach(self):
+        return self.passes * (self.box_size[0] // 2)
+
+    def blur(self, src, dst):
+        box = self.box_size
+        cv2.blur(src, ksize=box, dst=dst)
+        for _ in range(self.passes - 1):
+            cv2.blur(dst, ksize=box, dst=dst)
+
+
+@register_backend("kawase")
+class DualKawaseBlur(BlurBackend):
+    #Dual-filter blur: halve the image a few times with a small filter, then double it back up.
+    #On the CPU the pyramid filters of OpenCV play the role of the Kawase down/up-sample passes.
+    max_error = 13
+
+    def __init__(self, radius=16, strength=20):
+        super().__init__(radius, strength)
+        #one scratch array per pyramid level, reused between frames whatever the source shape
+        self._levels = []
+
+    @staticmethod
+    def _variance(iterations):
+        #variance of going down and back up `iterations` pyramid levels
+        return 2 * (4 ** iterations - 1) / 3
+
+    @cached_property
+    def iterations(self):
+        #the deepest pyramid that does not blur more than the reference
+        iterations = 1
+        while self._variance(iterations + 1) <= self.effective_sigma ** 2:
+            iterations += 1
+
+        return iterations
+
+    @cached_property
+    def residual_sigma(self):
+        #the blur still missing after the pyramid, applied at the smallest level where it is cheap
+        variance = max(self.effective_sigma ** 2 - self._variance(self.iterations), 0)
+
+        return math.sqrt(variance) / 2 ** self.iterations
+
+    @cached_property
+    def reach(self):
+        #the 5-tap pyramid filters reach 2 pixels per level on the way down and up, plus the residual blur
+        return 2 ** self.iterations * (4 + math.ceil(3 * self.residual_sigma))
+
+    def _pyramid(self, shape):
+        iterations = self.iterations
+        while len(self._levels) < iterations:
+            self._levels.append(Scratch())
+
+        levels = []
+        height, width = shape[:2]
+        for scratch in self._levels[:iterations]:
+            height, width = (height + 1) // 2, (width + 1) // 2
+            levels.append(scratch.get((height, width, *shape[2:])))
+
+        return levels
+
+    def blur(self, src, dst):
+        levels = self._pyramid(src.shape)
+
+        previous = src
+        for level in levels:
+            cv2.pyrDown(previous, dst=level, dstsize=level.shape[1::-1])
+            previous = level
+
+        if self.residual_sigma > 0.3:
+            cv2.GaussianBlur(previous, ksize=(0, 0), sigmaX=self.residual_sigma, dst=previous)
+
+        for level in reversed(levels[:-1]):
+            cv2.pyrUp(previous, dst=level, dstsize=level.shape[1::-1])
+            previous = level
+
+        cv2.pyrUp(previous, dst=dst, dstsize=dst.shape[1::-1])
@@ -0,0 +1,121 @@
+import json
+import time
+import select
+import socket
+import logging
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_ADDRESS = ("127.0.0.1", 5005)
+#largest datagram read in one go, bigger batches are truncated by the socket
+MAX_DATAGRAM = 65507
+
+
+def parse_address(text):
+    #"host:port" -> (host, port)
+    host, _, port = text.rpartition(":")
+    return (host or DEFAULT_ADDRESS[0], int(port))
+
+
+class CommandChannel:
+    #Non-blocking UDP endpoint the 'brain' sends face commands to.
+    #A datagram holds one JSON command or a JSON list of them, e.g.
+    #   {"expression": "angry"}    {"mien": "open_smile"}    {"gaze": [40, -20]}    {"move": [1, 0]}
+    #poll() is called once per frame and never waits: it reads at most `max_datagrams` datagrams and returns
+    #at most `max_commands` commands, leaving anything more in the socket for the next frame. Commands past
+    #the limit in a datagram already read are kept for the next poll(), which reads no new datagram until
+    #they have all been returned.
+    #A command may carry an "id"; once a presented frame shows its effect, acknowledge() sends
+    #{"id": ..., "presented": <time.time()>} back to the sender so it can measure the latency.
+    def __init__(self, address=DEFAULT_ADDRESS, max_datagrams=16, max_commands=64):
+        self.address = address
+        self.max_datagrams = max_datagrams
+        self.max_commands = max_commands
+
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._socket.setblocking(False)
+        self._socket.bind(tuple(address))
+        #[id, sender, presented frames still to wait for (None until a frame shows the command)] of commands
+        #with an id, waiting to be on screen
+        self._pending = []
+        #commands read but not returned yet, the rest of a batch past max_commands
+        self._backlog = deque()
+
+    def poll(self):
+        commands = self._take()
+        for _ in range(self.max_datagrams):
+            if len(commands) >= self.max_commands:
+                break
+
+            try:
+                data, sender = self._socket.recvfrom(MAX_DATAGRAM)
+            except BlockingIOError:
+                break
+
+            try:
+                batch = json.loads(data)
+            except ValueError:
+                logger.warning("Ignoring malformed command from %s: %r", sender, data[:80])
+                continue
+
+            for command in batch if isinstance(batch, list) else [batch]:
+                if not isinstance(command, dict):
+                    logger.warning("Ignoring command from %s that is not an object: %r", sender, command)
+                    continue
+
+                self._backlog.append((command, sender))
+            commands += self._take(self.max_commands - len(commands))
+
+        return commands
+
+    def _take(self, count=None):
+        #up to count (max_commands) commands off the backlog
+        count = self.max_commands if count is None else count
+        commands = []
+        while self._backlog and len(commands) < count:
+            command, sender = self._backlog.popleft()
+            commands.append(command)
+            if "id" in command:
+                self._pending.append([command["id"], sender, None])
+
+        return commands
+
+    def wait(self, timeout):
+        #block until a datagram is waiting or timeout seconds pass, returns whether one is waiting
+        readable, _, _ = select.select([self._socket], [], [], timeout)
+        return bool(readable)
+
+    def acknowledge(self, shown=True, latency_frames=0):
+        #Tell senders their commands are on screen, call right after presenting a frame. shown: whether the
+        #frame shows the effect of every command taken so far (sprites start an animation a frame after they
+        #are asked for it); latency_frames: how many frames later the frame really reaches the screen, for a
+        #post-processor that returns its results late
+        if not self._pending:
+            return
+
+        presented = time.time()
+        waiting = []
+        for entry in self._pending:
+            command_id, sender, frames = entry
+            if frames is None:
+                if not shown:
+                    waiting.append(entry)
+                    continue
+                frames = latency_frames
+            else:
+                frames -= 1
+
+            if frames > 0:
+                entry[2] = frames
+                waiting.append(entry)
+                continue
+
+            try:
+                self._socket.sendto(json.dumps({"id": command_id, "presented": presented}).encode(), sender)
+            except OSError as error:
+                logger.warning("Could not acknowledge command %s to %s: %s", command_id, sender, error)
+        self._pending = waiting
+
+    def close(self):
+        self._socket.close()
@@ -0,0 +1,106 @@
+import sys
+import json
+import time
+import socket
+import argparse
+
+import numpy as np
+
+from brain import DEFAULT_ADDRESS, parse_address
+
+
+#Local stand-in for the brain: sends commands to a running dynamic_eyes.py --brain and can measure how
+#long they take to reach the screen.
+#   python brain_client.py --expression angry --mien open_smile
+#   python brain_client.py --gaze 40 -20
+#   python brain_client.py --latency 200
+
+
+def send(sock, address, commands):
+    sock.sendto(json.dumps(commands).encode(), address)
+
+
+def receive_ack(sock, sent, to_screen, round_trip):
+    #wait (up to the socket timeout) for one acknowledgement; False if none came
+    try:
+        data, _ = sock.recvfrom(1024)
+    except socket.timeout:
+        return False
+
+    ack = json.loads(data)
+    if ack.get("id") in sent:
+        wall_sent, perf_sent = sent.pop(ack["id"])
+        to_screen.append(1000 * (ack["presented"] - wall_sent))
+        round_trip.append(1000 * (time.perf_counter() - perf_sent))
+
+    return True
+
+
+def measure_latency(sock, address, count, interval, timeout):
+    #send `count` commands with ids and wait for the face to acknowledge each one once presented
+    expressions = ["angry", "neutral", "sad", "neutral", "bored", "neutral"]
+    sent = {}
+    to_screen = []
+    round_trip = []
+
+    for i in range(count):
+        sent[i] = (time.time(), time.perf_counter())
+        send(sock, address, {"id": i, "expression": expressions[i % len(expressions)]})
+
+        #collect acknowledgements until it is time to send the next command
+        deadline = time.perf_counter() + interval
+        while sent and time.perf_counter() < deadline:
+            sock.settimeout(max(deadline - time.perf_counter(), 0.001))
+            if not receive_ack(sock, sent, to_screen, round_trip):
+                break
+
+    #wait for stragglers
+    sock.settimeout(timeout)
+    while sent and receive_ack(sock, sent, to_screen, round_trip):
+        pass
+
+    print(f"{len(to_screen)}/{count} commands acknowledged")
+    for name, times in (("command to screen", to_screen), ("round trip", round_trip)):
+        if times:
+            p50, p90, p99 = np.percentile(times, (50, 90, 99))
+            print(f"  {name:<18} p50 {p50:6.2f}  p90 {p90:6.2f}  p99 {p99:6.2f}  max {max(times):6.2f} ms")
+
+    return 0 if not sent else 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Send commands to the face like the brain would")
+    parser.add_argument("--address", default=f"{DEFAULT_ADDRESS[0]}:{DEFAULT_ADDRESS[1]}", help="HOST:PORT the face listens on")
+    parser.add_argument("--expression", help="neutral, angry, bored or sad")
+    parser.add_argument("--mien", help="open, closed, open_smile, closed_smile, closed_sad or open_sad")
+    parser.add_argument("--gaze", nargs=2, type=int, metavar=("X", "Y"), help="look this many pixels away from the resting position")
+    parser.add_argument("--move", nargs=2, type=int, metavar=("DX", "DY"), help="nudge the eyes in this direction")
+    parser.add_argument("--latency", type=int, metavar="COUNT", help="measure command-to-screen latency over COUNT commands")
+    parser.add_argument("--interval", type=float, default=0.25, help="seconds between latency commands, long enough for an expression to finish")
+    parser.add_argument("--timeout", type=float, default=1.0, help="seconds to wait for an acknowledgement")
+    args = parser.parse_args()
+
+    address = parse_address(args.address)
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    if args.latency:
+        return measure_latency(sock, address, args.latency, args.interval, args.timeout)
+
+    command = {}
+    if args.expression:
+        command["expression"] = args.expression
+    if args.mien:
+        command["mien"] = args.mien
+    if args.gaze:
+        command["gaze"] = args.gaze
+    if args.move:
+        command["move"] = args.move
+    if not command:
+        parser.error("nothing to send")
+
+    send(sock, address, command)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,41 +1,110 @@
 import numpy as np
 import cv2
 import pygame as pg
-import random
+import time
+import logging
+import argparse
+import math
+import weakref
 from enum import Enum
 
+from blur import BACKENDS, GaussianBlur
+from post_processing import create_post_processor
+from post_worker import ProcessPostProcessor
+from quality import AdaptiveQuality, quality_tiers
+from profiling import FrameProfiler, ProfilerOverlay
+from brain import CommandChannel, DEFAULT_ADDRESS, parse_address
+from renderer import Renderer
+from animation import Timeline, FrameCache, IdleMotion, keyframes_via
+from sdf import EyeShapes, Glow
+from face import FacePlan, Expression, Mien, DEFAULT_FACE, load_face
+
 class State(Enum):
     IDLE = 0
     ACTIVE = 1
     FINISHED = 2
 
-class Expression(Enum):
-    NEUTRAL = 0
-    SAD = 1
-    ANGRY = 2
-    BORED = 3
-
-class Mien(Enum):
-    OPEN = 0
-    CLOSED = 1
-    CLOSED_SMILE = 2
-    OPEN_SMILE = 3
-    CLOSED_SAD = 3
-    OPEN_SAD = 4
 
+#seconds between idle flicker moves with idle_sleep, which has to sleep between them to save anything
+IDLE_FLICKER = 0.25
+#longest idle_sleep sleeps at a time when nothing is scheduled
+MAX_SLEEP = 1.0
+
+#Keyboard stand-in for the brain: held keys map to the same commands the brain sends
+KEY_COMMANDS = {
+    pg.K_q: {"expression": "neutral"},
+    pg.K_w: {"expression": "angry"},
+    pg.K_e: {"expression": "bored"},
+    pg.K_r: {"expression": "sad"},
+    pg.K_t: {"mien": "closed"},
+    pg.K_y: {"mien": "closed_smile"},
+    pg.K_u: {"mien": "closed_sad"},
+    pg.K_i: {"mien": "open"},
+    pg.K_o: {"mien": "open_smile"},
+    pg.K_p: {"mien": "open_sad"},
+}
+
+def keyboard_commands(keys):
+    commands = [command for key, command in KEY_COMMANDS.items() if keys[key]]
+
+    dx = keys[pg.K_RIGHT] - keys[pg.K_LEFT]
+    dy = keys[pg.K_DOWN] - keys[pg.K_UP]
+    if dx or dy:
+        commands.append({"move": [dx, dy]})
+
+    return commands
+
+def handle_command(command, eyes, mouth):
+    #Apply one brain command: {"expression": name}, {"mien": name}, {"gaze": [x, y]} and/or {"move": [dx, dy]}
+    try:
+        if "expression" in command:
+            expression = Expression[command["expression"].upper()]
+            for eye in eyes:
+                eye.express(expression)
+        if "mien" in command:
+            mouth.express(Mien[command["mien"].upper()])
+        if "gaze" in command:
+            x, y = command["gaze"]
+            for eye in eyes:
+                eye.look(x, y)
+        if "move" in command:
+            dx, dy = command["move"]
+            for eye in eyes:
+                eye.move(dx, dy)
+    except (KeyError, AttributeError, TypeError, ValueError) as error:
+        logging.warning("Ignoring invalid command %r: %r", command, error)
 
 def glassy_blur(pg_surface):
     np_image = pg.surfarray.array3d(pg_surface)
     np_blurred = cv2.GaussianBlur(np_image, ksize=(33, 33), sigmaX=20, sigmaY=20)
     return pg.surfarray.make_surface(np_blurred)
 
-class Eye(pg.sprite.Sprite):
-    def __init__(self, centre, iris_color, iris_radius, pupil_color=(0,0,0), pupil_radius = 0, left_eye:bool = False, velocity=0):
+class Eye(pg.sprite.DirtySprite):
+    #How long each expression takes to tween out of neutral in seconds (30 steps at 60fps), and how its progress is
+    #eased; going back to neutral plays the same tween in reverse
+    durations = {Expression.NEUTRAL: 0, Expression.ANGRY: 0.5, Expression.BORED: 0.5, Expression.SAD: 0.5}
+    easings = {Expression.NEUTRAL: "linear", Expression.ANGRY: "ease_out", Expression.BORED: "ease_in_out", Expression.SAD: "ease_out"}
+
+    def __init__(self, centre, iris_color, iris_radius, pupil_color=(0,0,0), pupil_radius = 0, left_eye:bool = False, velocity=0, durations=None, easings=None, antialias=True, glow=None, steps=30, cache_size=None, idle_motion=None, mirror=None, bounds=None):
+        #antialias: draw from distance fields with smooth edges (sdf.EyeShapes) instead of pg.draw
+        #glow: sigma of an analytic glow (sdf.Glow) drawn alongside every frame, None for none
+        #steps: how many frames a transition between expressions is drawn in
+        #cache_size: how many drawn frames to keep (about 2MB each for a 700x700 eye), steps + 1 by default: the
+        #tween of the expression shown last, so going back to neutral draws nothing, while the first frames of
+        #another expression are drawn as they are shown. 0 keeps all of them (1 + steps per expression), drawn
+        #ahead at startup.
+        #idle_motion: animation.IdleMotion the eye follows while idle, shared with the other eye; a seeded one by default
+        #mirror: the other eye, if it looks just like this one would on the other side of the face: this eye then
+        #shows that eye's frames flipped instead of drawing its own (antialias and glow come from it), and caches
+        #only the flipped frames of slanted lids
+        #bounds: rect (the screen) that move() and look() keep the eye's centre in, None for no limit
+
         #Call the Sprite constructor
         super().__init__()
 
         self.state = State.IDLE
         self.expression = Expression.NEUTRAL
+        self.requested_expression = None
 
         self.initial_position = centre
 
@@ -46,314 +115,646 @@ class Eye(pg.sprite.Sprite):
         self.pupil_color = pupil_color
         self.pupil_radius = pupil_radius
 
-        self.idle_velocity = 1
-        self._idle_incr = 0
-        self._idle_up_flag = True
-        self._idle_max_position = 20
+        self.idle_motion = idle_motion if idle_motion is not None else IdleMotion()
+        self._idle_time = 0
 
-        self._expression_incr = 0
+        self._expression_time = 0
 
         self.movement_velocity = velocity
 
         self.left_eye = left_eye #0-> right, 1 -> left
 
+        #where the eye is without the idle motion, moved by move() and look()
+        self.centre = tuple(centre)
+        self.bounds = pg.Rect(bounds) if bounds is not None else None
+
         #Initialise the iris
         self._white = (255, 255, 255)
-        self.image = pg.Surface((2*iris_radius, 2*iris_radius))
-        self.image.set_colorkey(self._white)
-        self._draw_iris()
-        self._draw_pupil()
-        
+        self.mirror = mirror
+        if mirror is not None:
+            self.shapes, self.glow = mirror.shapes, mirror.glow
+        else:
+            self.shapes = EyeShapes(iris_radius) if antialias else None
+            self.glow = Glow(iris_radius, glow) if glow else None
+        self.glow_reach = self.glow.reach if self.glow is not None else 0
+        #glow colours of the iris and pupil, per pupil radius
+        self._glow_colors = {}
+        if mirror is not None:
+            self._canvas = None
+        elif antialias:
+            self._canvas = pg.Surface((2*iris_radius, 2*iris_radius), pg.SRCALPHA)
+        else:
+            self._canvas = pg.Surface((2*iris_radius, 2*iris_radius))
+            self._canvas.set_colorkey(self._white)
+
+        #Every expression is a pose the eye is tweened to, by way of neutral (see animation.keyframes_via). Each step
+        #of a tween is drawn once and cached, update() then only looks frames up (and the renderer their glow in glows)
+        self.poses = self._poses()
+        self.steps = steps
+        self.glows = weakref.WeakKeyDictionary() if self.glow is not None else None
+        maxsize = frame_cache_size(cache_size, steps)
+        self.frames = FrameCache(self._mirrored if mirror is not None else self._render, maxsize)
+        self.durations = {**self.durations, **(durations or {})}
+        self.easings = {**self.easings, **(easings or {})}
+
+        self.pose = self.poses[Expression.NEUTRAL]
+        self._timeline = None
+        if mirror is None and maxsize is None:
+            self._draw_ahead(Expression.NEUTRAL)
+        self.image = self.frames.get(self.pose)
+
         #Fetch the rect that has the initial position and dimensions of the surfaces
         self.rect = self.image.get_rect()
-        self.rect.move_ip(centre[0]-iris_radius, centre[1]-iris_radius)
-
-    def update(self): #On each iteration update the eye's current state - when added to a pygame group, it can be invoked via group.update() -> for both eyes
-        keys = pg.key.get_pressed()
-
-        #Update position
-        self.move(keys)
+        self.flicker()
+
+    def _poses(self):
+        #lid: height of the eyelid's lower edge at the middle of the eye, 0 for none
+        #slant: how much lower the edge is on the side of the nose than on the other
+        #pupil: pupil radius
+        r = self.iris_radius
+        #the lid comes down as far as the 100-pixel steps the expressions used to take went
+        end = 100 * math.ceil(r / 100)
+        return {
+            Expression.NEUTRAL: {"lid": 0, "slant": 0, "pupil": self.pupil_radius},
+            Expression.BORED: {"lid": end, "slant": 0, "pupil": self.pupil_radius},
+            Expression.ANGRY: {"lid": end - 0.25 * r, "slant": 0.5 * r, "pupil": self.pupil_radius},
+            Expression.SAD: {"lid": end - 0.25 * r, "slant": -0.5 * r, "pupil": self.pupil_radius},
+        }
+
+    def _draw_ahead(self, rest):
+        #Draw every step of the tweens out of the rest pose at startup, so no transition draws while animating
+        for expression in self.poses:
+            keyframes = keyframes_via(rest, rest, expression, self.poses, self.durations, self.easings)
+            for pose in Timeline(keyframes, self.steps).poses():
+                self.frames.get(pose)
+
+    def _lid(self, pose):
+        #(left, right) heights of the lid's edge for a pose; the nose is left of the left eye and right of the right one
+        nose, outer = pose["lid"] + pose["slant"] / 2, pose["lid"] - pose["slant"] / 2
+        if nose <= 0 and outer <= 0:
+            return None
+
+        return (nose, outer) if self.left_eye else (outer, nose)
+
+    def _render(self, pose):
+        #draw the frame of a pose, see FrameCache
+        self._draw(lid=self._lid(pose), pupil_radius=pose["pupil"])
+        frame = self._canvas.copy()
+        if self.glow_image is not None:
+            self.glows[frame] = self.glow_image
+
+        return frame
+
+    def _mirrored(self, pose):
+        #the frame of a pose flipped from the mirrored eye's, see FrameCache; a level lid looks the same from
+        #either side, so those frames are shared rather than flipped
+        frame = self.mirror.frames.get(pose)
+        glow = self.mirror.glows[frame] if self.glows is not None else None
+        if pose["slant"] != 0:
+            frame = pg.transform.flip(frame, True, False)
+            glow = pg.transform.flip(glow, True, False) if glow is not None else None
+        if glow is not None:
+            self.glows[frame] = glow
+
+        return frame
+
+    def update(self, dt=1/60): #On each iteration update the eye's current state - when added to a pygame group, it can be invoked via group.update(dt) -> for both eyes
+        #dt is the time since the last update in seconds
 
         #Update expression
         if self.state == State.IDLE:
-            #TODO: For integration, replace this with a message from 'brain' or equivalent 
-            #If key pressed, transition to active state and specify which expression to run
-            if(keys[pg.K_q]):
-                self.expression = Expression.NEUTRAL
-                self.state = State.ACTIVE
-            elif(keys[pg.K_w]):
-                self.expression = Expression.ANGRY
-                self.state = State.ACTIVE
-            elif(keys[pg.K_e]):
-                self.expression = Expression.BORED
-                self.state = State.ACTIVE
-            elif(keys[pg.K_r]):
-                self.expression = Expression.SAD
+            #If the brain (or keyboard) asked for an expression, transition to active state and run it
+            if self.requested_expression is not None:
+                keyframes = keyframes_via(Expression.NEUTRAL, self.expression, self.requested_expression, self.poses, self.durations, self.easings)
+                self._timeline = Timeline(keyframes, self.steps)
+                self.expression = self.requested_expression
+                self.requested_expression = None
                 self.state = State.ACTIVE
             
+            self._idle_time += dt
             self.flicker()
 
         elif self.state == State.ACTIVE:
-            #run an iteration of whichever expression is active
-            match self.expression:
-                case Expression.NEUTRAL:
-                    status = self.neutral()
-                case Expression.ANGRY:
-                    status = self.angry()
-                case Expression.BORED:
-                    status = self.bored()
-                case Expression.SAD:
-                    status = self.sad()
-            
-            if (status):
+            #show the cached frame of the step the transition has reached in the time elapsed so far
+            self._expression_time += dt
+            self.pose = self._timeline.pose(self._expression_time)
+
+            image = self.frames.get(self.pose)
+            if image is not self.image:
+                self.image = image
+                self.dirty = 1
+
+            if self._timeline.finished(self._expression_time):
                 self.state = State.FINISHED
 
         elif self.state == State.FINISHED:
             #clean up and transition to idle
-            self._expression_incr = 0
+            self._expression_time = 0
+            self._timeline = None
             self.state = State.IDLE
 
-    def move(self, keys):
-        if keys[pg.K_RIGHT]:
-            self.rect.move_ip(self.movement_velocity, 0)
-        if keys[pg.K_LEFT]:
-            self.rect.move_ip(-self.movement_velocity, 0)
-        if keys[pg.K_DOWN]:
-            self.rect.move_ip(0, self.movement_velocity)
-        if keys[pg.K_UP]:
-            self.rect.move_ip(0, -self.movement_velocity)
+    def express(self, expression):
+        #Request an expression, it starts as soon as the eye is idle
+        self.requested_expression = expression
+
+    def responding(self):
+        #whether an expression asked for has yet to show: it waits until the eye is idle, and update() starts it
+        #a frame before its first step is shown
+        return self.requested_expression is not None or (self.state == State.ACTIVE and self._expression_time == 0)
+
+    def next_update(self):
+        #seconds until update() will change how the eye looks by itself, 0 for the next update
+        if self.state != State.IDLE or self.requested_expression is not None:
+            return 0
+
+        return self.idle_motion.next_change(self._idle_time)
+
+    def move(self, dx, dy):
+        #Move by the movement velocity in the direction (dx, dy), each between -1 and 1 (clamped to that)
+        self._check(dx, dy)
+        dx, dy = min(max(dx, -1), 1), min(max(dy, -1), 1)
+        self._place(self.centre[0] + dx * self.movement_velocity, self.centre[1] + dy * self.movement_velocity)
+
+    def look(self, x, y):
+        #Gaze: place the eye (x, y) pixels away from where it started
+        self._check(x, y)
+        self._place(self.initial_position[0] + x, self.initial_position[1] + y)
+
+    @staticmethod
+    def _check(x, y):
+        #commands come from the network, so anything but two finite numbers is turned away before it moves the eye
+        if not all(isinstance(value, (int, float)) and math.isfinite(value) for value in (x, y)):
+            raise ValueError(f"({x!r}, {y!r}) is not a finite position")
+
+    def _place(self, x, y):
+        #move the eye's centre, kept inside the bounds, and put the eye there; the centre only changes once the
+        #rect has taken the new position, so a position it cannot take leaves the eye where it was
+        if self.bounds is not None:
+            x = min(max(x, self.bounds.left), self.bounds.right)
+            y = min(max(y, self.bounds.top), self.bounds.bottom)
+
+        dx, dy = self.idle_motion.offset(self._idle_time)
+        self.rect.center = (round(x + dx), round(y + dy))
+        self.centre = (x, y)
     
     #This is purely stylistic
     def flicker(self):
-        self.rect.move_ip(round(random.uniform(-1, 1)), random.uniform(-1, 1))
-
-    def _draw_iris(self):
-        self.image.fill(self._white)
-        pg.draw.circle(surface=self.image, color=self.iris_color, center=(self.iris_radius, self.iris_radius), radius=self.iris_radius) 
-
-    def _draw_pupil(self):
-        pg.draw.circle(surface=self.image, color=self.pupil_color, center=(self.iris_radius, self.iris_radius), radius=self.pupil_radius)
-
-    def neutral(self):
-        self._draw_iris()
-        self._draw_pupil()
+        #put the eye where the idle motion has it after the time spent idle
+        dx, dy = self.idle_motion.offset(self._idle_time)
+        self.rect.center = (round(self.centre[0] + dx), round(self.centre[1] + dy))
+
+    def _draw(self, lid=None, pupil_radius=None):
+        #Draw the eye, with an eyelid whose lower edge runs from height lid[0] on the left to lid[1] on the right
+        if pupil_radius is None:
+            pupil_radius = self.pupil_radius
+
+        if self.glow is not None:
+            distance = self.glow.circle(self.iris_radius)
+            if lid is not None:
+                distance = np.maximum(distance, self.glow.below(*lid))
+            if pupil_radius not in self._glow_colors:
+                self._glow_colors[pupil_radius] = self.glow.disc(self.iris_color, self.pupil_color, pupil_radius)
+            self.glow_image = self.glow.render(distance, self._glow_colors[pupil_radius])
+        else:
+            self.glow_image = None
 
-        return True
+        if self.shapes is not None:
+            self.shapes.render(self._canvas, self.iris_color, self.pupil_color, pupil_radius, lid)
+            return
 
-    def bored(self):
-        #start from neutral
-        self._draw_iris()
-        self._draw_pupil()
-
-        #increment counter
-        self._expression_incr += 100
-
-        #generate and draw the eyelid
-        eyelid_rect = pg.Rect(0, 0, 2 * self.iris_radius, self._expression_incr) 
-        pg.draw.rect(surface=self.image, color=self._white, rect=eyelid_rect)
-
-        #return false if not end of animation
-        if self._expression_incr >= self.iris_radius:
-            return True
-        
-        return False
-        
-    def angry(self):
-        #start from neutral
         self._draw_iris()
-        self._draw_pupil()
-
-        #increment counter
-        self._expression_incr += 100
-
-        #draw eyelid
-        if (self.left_eye):
-            pg.draw.polygon(surface=self.image, color=self._white, points=[(0,0), (2*self.iris_radius, 0), (2*self.iris_radius, self._expression_incr-0.5*self.iris_radius), (0, self._expression_incr)])
+        self._draw_pupil(pupil_radius)
+        if lid is None:
+            return
+
+        left, right = lid
+        if left == right:
+            eyelid_rect = pg.Rect(0, 0, 2 * self.iris_radius, left)
+            pg.draw.rect(surface=self._canvas, color=self._white, rect=eyelid_rect)
         else:
-            pg.draw.polygon(surface=self.image, color=self._white, points=[(0,0), (2*self.iris_radius, 0), (2*self.iris_radius, self._expression_incr), (0, self._expression_incr-0.5*self.iris_radius)])
-    
-        #return false if not end of animation
-        if self._expression_incr >= self.iris_radius:
-            return True
-
-        return False
+            pg.draw.polygon(surface=self._canvas, color=self._white, points=[(0,0), (2*self.iris_radius, 0), (2*self.iris_radius, right), (0, left)])
 
-    def sad(self):
-        self._draw_iris()
-        self._draw_pupil()
+    def _draw_iris(self):
+        self._canvas.fill(self._white)
+        pg.draw.circle(surface=self._canvas, color=self.iris_color, center=(self.iris_radius, self.iris_radius), radius=self.iris_radius) 
 
-        #increment counter
-        self._expression_incr += 100
+    def _draw_pupil(self, radius):
+        pg.draw.circle(surface=self._canvas, color=self.pupil_color, center=(self.iris_radius, self.iris_radius), radius=radius)
+    
+class Mouth(pg.sprite.DirtySprite):
+    #How long each mien takes to tween out of the open mouth in seconds, and how its progress is eased
+    durations = {Mien.OPEN: 0, Mien.OPEN_SMILE: 0.25, Mien.CLOSED: 0.25}
+    easings = {Mien.OPEN: "linear", Mien.OPEN_SMILE: "ease_in_out", Mien.CLOSED: "ease_in_out"}
 
-        if (self.left_eye):
-            pg.draw.polygon(surface=self.image, color=self._white, points=[(0,0), (2*self.iris_radius, 0), (2*self.iris_radius, self._expression_incr), (0, self._expression_incr-0.5*self.iris_radius)])
-        else:
-            pg.draw.polygon(surface=self.image, color=self._white, points=[(0,0), (2*self.iris_radius, 0), (2*self.iris_radius, self._expression_incr-0.5*self.iris_radius), (0, self._expression_incr)])
+    def __init__(self, centre, color, radius, velocity = 0, durations=None, easings=None, glow=None, steps=15, cache_size=None):
+        #glow: sigma of an analytic glow (sdf.Glow) drawn alongside every frame, None for none
+        #steps: how many frames a transition between miens is drawn in
+        #cache_size: how many drawn frames to keep, steps + 1 by default, 0 for all of them (see Eye)
 
-        #return false if not end of animation
-        if self._expression_incr >= self.iris_radius:
-            return True
+        #Call the Sprite constructor
+        super().__init__()
 
-        return False
-    
-class Mouth(pg.sprite.Sprite):
-    def __init__(self, centre, color, radius, velocity = 0):
         self.state = State.IDLE
         self.mien = Mien.OPEN
+        self.requested_mien = None
 
         self.centre = centre
         self.color = color
         self.radius = radius
         self.movement_velocity = velocity
 
+        self._mien_time = 0
+
         self._white = (255, 255, 255)
-        self.image = pg.Surface((2*radius, 2*radius))
-        self.image.set_colorkey(self._white)
-        self.open()
+        self._canvas = pg.Surface((2*radius, 2*radius))
+        self._canvas.set_colorkey(self._white)
+
+        self.glow = Glow(radius, glow) if glow else None
+        self.glow_reach = self.glow.reach if glow else 0
+
+        #Miens are poses of the mouth tweened by way of the open mouth like the eyes' expressions by way of neutral
+        #lip: height of the top lip, cutting off the top of the mouth for a smile
+        #opening: half the height of the mouth, down from the radius when open to a line when closed
+        #CLOSED_SMILE and OPEN_SAD have not been worked out yet, so they have no pose
+        self.poses = {
+            Mien.OPEN: {"lip": 0, "opening": radius},
+            Mien.OPEN_SMILE: {"lip": radius, "opening": radius},
+            Mien.CLOSED: {"lip": 0, "opening": 20},
+        }
+        self.steps = steps
+        self.glows = weakref.WeakKeyDictionary() if glow else None
+        maxsize = frame_cache_size(cache_size, steps)
+        self.frames = FrameCache(self._render, maxsize)
+        self.durations = {**self.durations, **(durations or {})}
+        self.easings = {**self.easings, **(easings or {})}
+
+        self.pose = self.poses[Mien.OPEN]
+        self._timeline = None
+        if maxsize is None:
+            self._draw_ahead(Mien.OPEN)
+        self.image = self.frames.get(self.pose)
 
         #Fetch the rect that has the initial position and dimensions of the surfaces
         self.rect = self.image.get_rect()
         self.rect.move_ip(centre[0]-radius, centre[1]-radius)
     
-    def update(self):
-        keys = pg.key.get_pressed()
-
+    def update(self, dt=1/60):
         #Update mien
         if self.state == State.IDLE:
-            #TODO: For integration, replace this with a message from 'brain' or equivalent 
-            #If key pressed, transition to active state and specify which mien to show on mouth
-            if(keys[pg.K_t]):
-                self.expression = Mien.CLOSED
-                self.state = State.ACTIVE
-            elif(keys[pg.K_y]):
-                self.expression = Mien.CLOSED_SMILE
-                self.state = State.ACTIVE
-            elif(keys[pg.K_u]):
-                self.expression = Mien.CLOSED_SAD
-                self.state = State.ACTIVE
-            elif(keys[pg.K_i]):
-                self.expression = Mien.OPEN
-                self.state = State.ACTIVE
-            elif(keys[pg.K_o]):
-                self.expression = Mien.OPEN_SMILE
-                self.state = State.ACTIVE
-            elif(keys[pg.K_p]):
-                self.expression = Mien.OPEN_SAD
-                self.state = State.ACTIVE
+            #If the brain (or keyboard) asked for a mien, transition to active state and show it on the mouth
+            if self.requested_mien is not None:
+                self.expression = self.requested_mien
+                self.requested_mien = None
+                #mien is the last mien with a pose, the one the mouth shows; a mien without a pose leaves the
+                #mouth as it is, and the next one is taken as soon as it is asked for
+                if self.expression in self.poses:
+                    keyframes = keyframes_via(Mien.OPEN, self.mien, self.expression, self.poses, self.durations, self.easings)
+                    self._timeline = Timeline(keyframes, self.steps)
+                    self.mien = self.expression
+                    self.state = State.ACTIVE
             
         elif self.state == State.ACTIVE:
-            #run an iteration of whichever expression is active
-            status = False
-
-            match self.expression:
-                case Mien.CLOSED:
-                    status = self.close()
-                case Mien.CLOSED_SMILE:
-                    pass
-                case Mien.CLOSED_SAD:
-                    pass
-                case Mien.OPEN:
-                    status = self.open()
-                case Mien.OPEN_SMILE:
-                    status = self.open_smile()
-                case Mien.OPEN_SAD:
-                    pass
-
-            if (status):
+            #show the cached frame of the step the transition has reached in the time elapsed so far
+            self._mien_time += dt
+            self.pose = self._timeline.pose(self._mien_time)
+
+            image = self.frames.get(self.pose)
+            if image is not self.image:
+                self.image = image
+                self.dirty = 1
+
+            if self._timeline.finished(self._mien_time):
                 self.state = State.FINISHED
 
         elif self.state == State.FINISHED:
             #clean up and transition to idle
+            self._mien_time = 0
+            self._timeline = None
             self.state = State.IDLE
-    
-    def open(self):
-        self.image.fill(self._white)
-        pg.draw.circle(surface=self.image, color=self.color, center=(self.radius, self.radius), radius=self.radius) 
 
-        return True
-
-    def open_smile(self):
-        self.open()
-        top_lip_rect = pg.Rect(0, 0, 2 * self.radius, self.radius) 
-        pg.draw.rect(surface=self.image, color=self._white, rect=top_lip_rect)
-
-        return True
-    
-    def close(self):
-        self.image.fill(self._white)
-        pg.draw.line(surface=self.image, color=self.color, start_pos=(0, self.radius), end_pos=(2*self.radius, self.radius), width=40)
-
-        return True
-
-def main():
-    #TUNE
-    black = (0,0,0)
-    pastel_blue = (171, 235, 255)
-    light_pastel_blue = (196, 233, 245)
-    sheen_pastel_blue = (230, 249, 255)
-
-    eye_radius = 350
-    pupil_radius = int(0.9625 * eye_radius)
-    mouth_radius = 100
+    def express(self, mien):
+        #Request a mien, it starts as soon as the mouth is idle
+        self.requested_mien = mien
+
+    def responding(self):
+        #whether a mien asked for has yet to show, like Eye.responding
+        return self.requested_mien is not None or (self.state == State.ACTIVE and self._mien_time == 0)
+
+    def next_update(self):
+        #seconds until update() will change how the mouth looks by itself, 0 for the next update, None for never
+        if self.requested_mien is not None or self.state != State.IDLE:
+            return 0
+
+        return None
+
+    def _draw_ahead(self, rest):
+        #Draw every step of the tweens out of the rest pose at startup, like Eye._draw_ahead
+        for mien in self.poses:
+            keyframes = keyframes_via(rest, rest, mien, self.poses, self.durations, self.easings)
+            for pose in Timeline(keyframes, self.steps).poses():
+                self.frames.get(pose)
+
+    def _render(self, pose):
+        #Draw the frame of a pose, see FrameCache: the open mouth with the top lip and the lips above and below
+        #the opening cut away
+        lip, opening = pose["lip"], pose["opening"]
+        self._canvas.fill(self._white)
+        pg.draw.circle(surface=self._canvas, color=self.color, center=(self.radius, self.radius), radius=self.radius)
+        if lip > 0:
+            pg.draw.rect(surface=self._canvas, color=self._white, rect=pg.Rect(0, 0, 2 * self.radius, lip))
+        if opening < self.radius:
+            pg.draw.rect(surface=self._canvas, color=self._white, rect=pg.Rect(0, 0, 2 * self.radius, self.radius - opening))
+            pg.draw.rect(surface=self._canvas, color=self._white, rect=pg.Rect(0, self.radius + opening, 2 * self.radius, self.radius - opening))
+        frame = self._canvas.copy()
+
+        if self.glow is not None:
+            distance = self.glow.circle(self.radius)
+            if lip > 0:
+                distance = np.maximum(distance, self.glow.below(lip, lip))
+            if opening < self.radius:
+                distance = np.maximum(distance, self.glow.band(opening))
+            self.glows[frame] = self.glow.render(distance, self.color)
+
+        return frame
+
+def frame_cache_size(cache_size, steps):
+    #the FrameCache maxsize for a sprite's cache_size: None (the default) keeps one transition, 0 everything
+    if cache_size is None:
+        return steps + 1
+    return cache_size or None
+
+def compile_face(face, size=None, antialias=True, glow=None, idle_motion=None, cache_size=None):
+    #Build the sprites of a face description (see face.parse_face), laid out for a screen of `size` by scaling
+    #positions, and radii with the height, from the size the face was described at (the same size by default).
+    #Every frame of every sprite is drawn here, so the frame loop only picks frames and blits them.
+    #idle_motion: animation.IdleMotion all the eyes follow, a seeded one by default
+    #The eyes' move() and look() keep them on the screen.
+    #cache_size: how many frames each sprite keeps (see Eye), one transition's worth by default, 0 to draw and keep
+    #all of them
+    width, height = face["size"]
+    scale_x, scale_y = (size[0] / width, size[1] / height) if size is not None else (1, 1)
+    if idle_motion is None:
+        idle_motion = IdleMotion(scale=scale_y)
+
+    def timing(names, enum):
+        #names were checked by parse_face
+        settings = {enum[name.upper()]: values for name, values in names.items()}
+        durations = {key: values["duration"] for key, values in settings.items() if "duration" in values}
+        easings = {key: values["easing"] for key, values in settings.items() if "easing" in values}
+        return durations, easings
+
+    def centre(point):
+        return (round(point[0] * scale_x), round(point[1] * scale_y))
+
+    bounds = pg.Rect((0, 0), size if size is not None else (width, height))
+
+    durations, easings = timing(face["expressions"], Expression)
+    eyes = []
+    #the first eye of each look on each side of the face, so an eye on the other side can mirror it
+    drawn = {}
+    for eye in face["eyes"]:
+        eye = {**eye, "centre": centre(eye["centre"]), "iris_radius": round(eye["iris_radius"] * scale_y), "pupil_radius": round(eye.get("pupil_radius", 0) * scale_y), "velocity": eye.get("velocity", 0) * scale_y}
+        look = tuple(eye.get(key) for key in ("iris_color", "iris_radius", "pupil_color", "pupil_radius"))
+        side = bool(eye.get("left_eye", False))
+        mirror = drawn.get((look, not side))
+        eyes.append(Eye(**eye, durations=durations, easings=easings, antialias=antialias, glow=glow, idle_motion=idle_motion, mirror=mirror, cache_size=cache_size, bounds=bounds))
+        if mirror is None:
+            drawn.setdefault((look, side), eyes[-1])
+
+    durations, easings = timing(face["miens"], Mien)
+    mouth = {**face["mouth"], "centre": centre(face["mouth"]["centre"]), "radius": round(face["mouth"]["radius"] * scale_y), "velocity": face["mouth"].get("velocity", 0) * scale_y}
+    mouth = Mouth(**mouth, durations=durations, easings=easings, glow=glow, cache_size=cache_size)
+
+    return FacePlan(eyes, mouth, face["background"])
+
+def render_resolution(render_scale, display_size):
+    #The internal resolution to draw at: the display's own by default, a fraction of it for a float render_scale,
+    #or a (width, height) of its own
+    if render_scale is None:
+        return tuple(display_size)
+    if isinstance(render_scale, (int, float)):
+        return (round(display_size[0] * render_scale), round(display_size[1] * render_scale))
+
+    return tuple(render_scale)
+
+def parse_render_scale(text):
+    #"0.5" -> 0.5, "1280x720" -> (1280, 720)
+    if "x" in text.lower():
+        width, height = (int(value) for value in text.lower().split("x"))
+        return (width, height)
+
+    return float(text)
+
+def wait_for_input(channel, timeout, poll=0.05):
+    #Sleep until a brain command or a pygame event arrives, or timeout seconds pass. SDL cannot wait on the
+    #command socket as well, so with a channel, events (the keyboard) are only looked for every `poll` seconds.
+    deadline = time.perf_counter() + timeout
+    while True:
+        remaining = deadline - time.perf_counter()
+        if remaining <= 0:
+            return
+
+        if channel is None:
+            #waiting takes the event off the queue, so put it back for the frame loop
+            event = pg.event.wait(max(round(1000 * remaining), 1))
+            if event.type != pg.NOEVENT:
+                pg.event.post(event)
+            return
+
+        if channel.wait(min(remaining, poll)) or pg.event.peek():
+            return
+
+def shutdown(profiler, renderer):
+    if profiler.enabled:
+        for stage, summary in profiler.summary().items():
+            logging.info("%s: mean %.2f ms, p50 %.2f ms, p99 %.2f ms", stage, summary["mean"], summary["p50"], summary["p99"])
+
+    #stop any worker threads or processes of the post-processing
+    if hasattr(renderer.post_processor, "close"):
+        renderer.post_processor.close()
+
+    exit()
+
+def main(blur="gaussian", blur_radius=16, blur_strength=20, post="blur", bloom_levels=3, bloom_factor=0.5, dirty_rects=False, fps=60, adaptive=False, frame_budget_ms=1000/60, profile=False, brain_address=None, workers=1, opencv_threads=None, offprocess=False, sprite_glow=False, temporal=None, temporal_threshold=1, antialias=True, face=None, render_scale=None, upscale="scaled", idle_sleep=False, flicker_interval=None, seed=0, frame_cache=None):
+    #face: face description (see face.load_face), the one in face.json by default
+    #render_scale: resolution to draw at, see render_resolution; the face is laid out for it and scaled to the display
+    #upscale: how a render_scale frame reaches the display, "scaled" by SDL (pg.SCALED) or "smooth" by smoothscale
+    #idle_sleep: skip frames in which nothing changes and sleep until something will, see wait_for_input
+    #flicker_interval: seconds between idle flicker moves, a frame by default (IDLE_FLICKER with idle_sleep)
+    #seed: seed of the eyes' idle motion, the same seed moves them the same way every run
+    #frame_cache: frames each sprite keeps, by default one transition's worth (31 for an eye): at 1080p that stays
+    #under 150MB (350MB with post="analytic", whose glows are kept with the frames), but an expression's frames
+    #are drawn the first time they are shown after another, about 20ms each. 0 draws every frame of every
+    #transition at startup (1.5-4s) and keeps them, with no drawing while animating: about 300MB at 1080p
+    #(650MB with post="analytic").
+    if flicker_interval is None:
+        flicker_interval = IDLE_FLICKER if idle_sleep else 1 / (fps or 60)
+    if face is None:
+        face = load_face()
 
     #initialise pygame
     pg.init()
 
-    #Create a fullscreen display surface
-    screen = pg.display.set_mode(flags=pg.FULLSCREEN, vsync=1)
+    #Create a fullscreen display surface, or draw at a resolution of our own and scale it to the display
+    info = pg.display.Info()
+    render_size = render_resolution(render_scale, (info.current_w, info.current_h))
+    display = None
+    if render_size == (info.current_w, info.current_h):
+        screen = pg.display.set_mode(flags=pg.FULLSCREEN, vsync=1)
+    elif upscale == "scaled":
+        screen = pg.display.set_mode(render_size, flags=pg.FULLSCREEN | pg.SCALED, vsync=1)
+    else:
+        display = pg.display.set_mode(flags=pg.FULLSCREEN, vsync=1)
+        screen = pg.Surface(render_size, 0, display)
+
+    #the face, its motion and its glow are described at the face's size, and scaled with it to the screen
+    glow_scale = screen.get_height() / face["size"][1]
+    blur_radius = max(round(blur_radius * glow_scale), 1)
+    blur_strength = blur_strength * glow_scale
 
     #Create a pygame clock
     clock = pg.time.Clock()
 
-    #Instantiate the eye sprites
-    right_eye = Eye(centre=(480, 540), 
-                    iris_color=pastel_blue, 
-                    iris_radius=eye_radius, 
-                    pupil_color=sheen_pastel_blue, 
-                    pupil_radius=pupil_radius,
-                    velocity=8)
-    left_eye = Eye(centre=(1440, 540), 
-                   iris_color=pastel_blue, 
-                   iris_radius=eye_radius,  
-                   pupil_color=sheen_pastel_blue,
-                   pupil_radius=pupil_radius,
-                   velocity=8, 
-                   left_eye=True)
-    mouth = Mouth(centre=(960, 810),
-                  color=sheen_pastel_blue,
-                  radius=mouth_radius)
+    #Post-processing keeps its frame buffers between frames
+    settings = dict(post=post, blur=blur, radius=blur_radius, strength=blur_strength, bloom_levels=bloom_levels, bloom_factor=bloom_factor,
+                    workers=workers, opencv_threads=opencv_threads, temporal=temporal, temporal_threshold=temporal_threshold)
+
+    #Adaptive quality starts from the configured glow and falls back through cheaper ones, scaled like it, to hold
+    #the frame budget
+    quality = AdaptiveQuality(budget_ms=frame_budget_ms, tiers=quality_tiers(settings)) if adaptive else None
+    glow = None
+    if post == "analytic":
+        #the sprites draw their own glow from distance fields, with the falloff of the configured blur kernel
+        post_processor = None
+        sprite_glow = True
+        glow = math.sqrt(2) * GaussianBlur(radius=blur_radius, strength=blur_strength).effective_sigma
+    elif adaptive:
+        post_processor = quality.post_processor
+    elif offprocess:
+        #the glow runs in a worker process, overlapping the next frame's render at the cost of a frame of latency
+        post_processor = ProcessPostProcessor(settings)
+    else:
+        post_processor = create_post_processor(**settings)
+
+    #Per-stage timers; F1 toggles an overlay with their numbers, which turns the timers on too
+    profiler = FrameProfiler(enabled=profile)
+    overlay = ProfilerOverlay(profiler)
+
+    renderer = Renderer(screen, post_processor, background=face["background"], dirty_rects=dirty_rects, profiler=profiler, sprite_glow=sprite_glow, display=display, skip_unchanged=idle_sleep)
+
+    #Commands from the brain arrive on a local socket, drained without blocking once per frame
+    channel = CommandChannel(brain_address) if brain_address is not None else None
+
+    #Lay the face out and draw every frame of it up front
+    plan = compile_face(face, screen.get_size(), antialias=antialias, glow=glow, idle_motion=IdleMotion(seed, flicker_interval, scale=glow_scale), cache_size=frame_cache)
+
+    #seconds until anything changes by itself, which idle_sleep sleeps through
+    sleep = 0
 
     #game loop
     while True:
+        if sleep > 0:
+            wait_for_input(channel, sleep)
+
+        #wait for the next frame (fps=0 runs uncapped) and animate by the time that actually passed
+        dt = clock.tick(fps) / 1000
+        frame_start = time.perf_counter()
+        profiler.start()
+
         # event loop
         for event in pg.event.get():
             # check if a user wants to exit the game or not
             if event.type == pg.QUIT:
-                exit()
+                shutdown(profiler, renderer)
             if event.type == pg.KEYDOWN:
                 if event.key == pg.K_ESCAPE: #escape key to escape 
-                    exit()
-
-        #fill the screen with black
-        screen.fill(black)
-
-        left_eye.update()
-        right_eye.update()
-        mouth.update()
-        
-        #blit the sprites onto the screen
-        screen.blit(left_eye.image, left_eye.rect)
-        screen.blit(right_eye.image, right_eye.rect)
-        screen.blit(mouth.image, mouth.rect)
-
-        #!Apply any post-processing to the entire display here:
-        blurred_screen = glassy_blur(screen)
-        screen.blit(blurred_screen, blurred_screen.get_rect(center = screen.get_rect().center), special_flags = pg.BLEND_PREMULTIPLIED)
-
-        pg.display.update()
-
-        #set the frame rate to 60fps 
+                    shutdown(profiler, renderer)
+                if event.key == pg.K_F1:
+                    renderer.overlay = None if renderer.overlay is not None else overlay
+                    profiler.enabled = profile or renderer.overlay is not None
+
+        commands = keyboard_commands(pg.key.get_pressed())
+        if channel is not None:
+            commands += channel.poll()
+        for command in commands:
+            handle_command(command, plan.eyes, plan.mouth)
+        profiler.mark("input")
+
+        for sprite in plan.sprites:
+            sprite.update(dt)
+        profiler.mark("update")
+
+        presented = renderer.render(plan.sprites)
+        #a command is on screen once a presented frame shows it, and the post-processor has caught up with that frame
+        if channel is not None and presented != []:
+            channel.acknowledge(not any(sprite.responding() for sprite in plan.sprites), renderer.latency_frames)
+
+        #the frame's own work, without the wait in clock.tick; a skipped frame says nothing about the quality
+        if quality is not None and presented != [] and quality.frame(1000 * (time.perf_counter() - frame_start)):
+            renderer.set_post_processor(quality.post_processor)
+
+        #with nothing to show until a sprite changes by itself or input arrives, sleep instead of spinning
+        if idle_sleep and not commands and renderer.overlay is None and renderer.settled:
+            waits = [sprite.next_update() for sprite in plan.sprites]
+            sleep = min([wait for wait in waits if wait is not None] + [MAX_SLEEP])
+        else:
+            sleep = 0
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Animated face")
+    parser.add_argument("--face", default=DEFAULT_FACE, help="JSON or TOML description of the face, its glow settings are the defaults of the glow options")
+    parser.add_argument("--blur", choices=BACKENDS, default="gaussian", help="glow blur backend, cheapest last: gaussian, stack, box, kawase")
+    parser.add_argument("--blur-radius", type=int, default=16, help="how far the glow reaches, in pixels")
+    parser.add_argument("--blur-strength", type=float, default=20, help="sigma of the glow")
+    parser.add_argument("--post", choices=["blur", "bloom", "analytic"], default="blur", help="full-resolution blur, downsampled bloom pyramid or glow computed from the shapes")
+    parser.add_argument("--bloom-levels", type=int, default=3, help="number of pyramid levels for --post bloom")
+    parser.add_argument("--bloom-factor", type=float, default=0.5, help="scale between pyramid levels for --post bloom")
+    parser.add_argument("--workers", type=int, default=1, help="blur the frame in this many bands on a thread pool")
+    parser.add_argument("--opencv-threads", type=int, help="threads OpenCV may use itself (1 per worker is best with --workers)")
+    parser.add_argument("--offprocess", action="store_true", help="run the glow in a worker process, one frame behind the render")
+    parser.add_argument("--sprite-glow", action="store_true", help="glow each sprite frame once and add the glows up instead of blurring every frame")
+    parser.add_argument("--temporal", nargs="?", type=int, const=60, metavar="FRAMES", help="reuse the glow while the face barely moves, recomputing it at least every FRAMES frames")
+    parser.add_argument("--temporal-threshold", type=int, default=1, help="largest move in pixels a reused glow is shifted by with --temporal")
+    parser.add_argument("--no-antialias", action="store_true", help="draw the eyes with pg.draw instead of anti-aliased distance fields")
+    parser.add_argument("--render-scale", type=parse_render_scale, metavar="SCALE|WxH", help="draw at this fraction of the display resolution, or at WIDTHxHEIGHT, and scale up to the display")
+    parser.add_argument("--upscale", choices=["scaled", "smooth"], default="scaled", help="scale a --render-scale frame to the display by SDL (pg.SCALED) or by one smoothscale")
+    parser.add_argument("--idle-sleep", action="store_true", help="skip frames in which nothing changes and sleep until something will")
+    parser.add_argument("--flicker-interval", type=float, help=f"seconds between idle flicker moves (default a frame, {IDLE_FLICKER} with --idle-sleep)")
+    parser.add_argument("--frame-cache", type=int, metavar="FRAMES", help="frames each eye and the mouth keep, drawing the others as they are shown (default one transition, under 150MB at 1080p); 0 draws every frame at startup and keeps them, about 300MB at 1080p (650MB with --post analytic)")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the eyes' idle flicker and saccades")
+    parser.add_argument("--dirty-rects", action="store_true", help="only redraw and present the parts of the screen that changed")
+    parser.add_argument("--fps", type=int, default=60, help="frame rate cap, 0 for uncapped; animations keep their duration at any rate")
+    parser.add_argument("--adaptive", action="store_true", help="lower the glow quality automatically to hold the frame budget")
+    parser.add_argument("--frame-budget-ms", type=float, default=1000/60, help="frame time to hold with --adaptive")
+    parser.add_argument("--profile", action="store_true", help="time each stage of the frame and log a summary on exit (F1 shows them on screen)")
+    parser.add_argument("--brain", nargs="?", const=f"{DEFAULT_ADDRESS[0]}:{DEFAULT_ADDRESS[1]}", metavar="HOST:PORT", help="listen for brain commands on this UDP address")
+    #the face is read first, so its glow settings can stand in for the options not given
+    face_path, _ = parser.parse_known_args()
+    try:
+        face = load_face(face_path.face)
+    except (OSError, ValueError) as error:
+        parser.error(str(error))
+    parser.set_defaults(**face["glow"])
+
+    args = parser.parse_args()
+    if args.offprocess and args.adaptive:
+        parser.error("--offprocess and --adaptive cannot be combined: the worker's time is not part of the frame time")
+    if args.post == "analytic" and (args.adaptive or args.offprocess):
+        parser.error("--post analytic cannot be combined with --adaptive or --offprocess: it has no post-processing to adapt or move")
+    if args.offprocess and args.sprite_glow:
+        parser.error("--offprocess and --sprite-glow cannot be combined: sprite glows are made in the render loop")
+    if args.offprocess and args.temporal:
+        parser.error("--offprocess and --temporal cannot be combined: the worker blurs every frame it is handed")
+    if face["background"] != (0, 0, 0) and (args.sprite_glow or args.temporal or args.post == "analytic"):
+        parser.error("--sprite-glow, --temporal and --post analytic need a face with a black background: they add glows made on black")
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s: %(message)s")
+
+    main(blur=args.blur, blur_radius=args.blur_radius, blur_strength=args.blur_strength,
+         post=args.post, bloom_levels=args.bloom_levels, bloom_factor=args.bloom_factor,
+         dirty_rects=args.dirty_rects, fps=args.fps, adaptive=args.adaptive, frame_budget_ms=args.frame_budget_ms,
+         profile=args.profile, brain_address=parse_address(args.brain) if args.brain else None,
+         workers=args.workers, opencv_threads=args.opencv_threads, offprocess=args.offprocess, sprite_glow=args.sprite_glow,
+         temporal=args.temporal, temporal_threshold=args.temporal_threshold, antialias=not args.no_antialias, face=face,
+         render_scale=args.render_scale, upscale=args.upscale, idle_sleep=args.idle_sleep, flicker_interval=args.flicker_interval, seed=args.seed, frame_cache=args.frame_cache)
         
\ No newline at end of file
@@ -1,17 +1,5 @@
-import numpy as np
-import cv2
 import pygame as pg
 
-def create_neon(surf):
-    surf_alpha = surf.convert_alpha()
-    rgb = pg.surfarray.array3d(surf_alpha)
-    alpha = pg.surfarray.array_alpha(surf_alpha).reshape((*rgb.shape[:2], 1))
-    image = np.concatenate((rgb, alpha), 2)
-    cv2.GaussianBlur(image, ksize=(9, 9), sigmaX=10, sigmaY=10, dst=image)
-    cv2.blur(image, ksize=(5, 5), dst=image)
-    bloom_surf = pg.image.frombuffer(image.flatten(), image.shape[1::-1], 'RGBA')
-    return bloom_surf
-
 class eye(pg.sprite.Sprite):
     def __init__(self, centre, iris_color, iris_radius, pupil_color=None, pupil_radius=None, velocity=None):
         #Call the Sprite constructor
@@ -1,16 +1,6 @@
-import numpy
-import cv2
 import pygame
 
-def create_neon(surf):
-    surf_alpha = surf.convert_alpha()
-    rgb = pygame.surfarray.array3d(surf_alpha)
-    alpha = pygame.surfarray.array_alpha(surf_alpha).reshape((*rgb.shape[:2], 1))
-    image = numpy.concatenate((rgb, alpha), 2)
-    cv2.GaussianBlur(image, ksize=(9, 9), sigmaX=10, sigmaY=10, dst=image)
-    cv2.blur(image, ksize=(5, 5), dst=image)
-    bloom_surf = pygame.image.frombuffer(image.flatten(), image.shape[1::-1], 'RGBA')
-    return bloom_surf
+from neon import create_neon
 
 def main():
     # initialize pygame
@@ -43,8 +33,8 @@ def main():
     # define mouth
     mouth = pygame.draw.circle(surface=screen, color=pastel_blue, center=[960, 840], radius=mouth_radius)
     
-    neon_image = create_neon(screen)
-    neon_image = pygame.transform.rotate(neon_image, -90)
+    #the glow is cached and shared, draw the sheen on a copy
+    neon_image = create_neon(screen).copy()
 
     right_eye_sheen = pygame.draw.circle(surface=neon_image, color=sheen_pastel_blue, center=[480, 540], radius=sheen_radius)
     left_eye_sheen = pygame.draw.circle(surface=neon_image, color=sheen_pastel_blue, center=[1440, 540], radius=sheen_radius)
@@ -0,0 +1,132 @@
+import os
+import json
+import math
+from enum import Enum
+
+from animation import EASINGS
+
+from renderer import FaceGroup
+
+try:
+    import tomllib
+except ImportError:
+    #before Python 3.11 faces can only be described in JSON
+    tomllib = None
+
+#What the eyes and the mouth can show; a face gives them by their lower-case names
+class Expression(Enum):
+    NEUTRAL = 0
+    SAD = 1
+    ANGRY = 2
+    BORED = 3
+
+class Mien(Enum):
+    OPEN = 0
+    CLOSED = 1
+    CLOSED_SMILE = 2
+    OPEN_SMILE = 3
+    CLOSED_SAD = 5
+    OPEN_SAD = 4
+
+
+#the face dynamic_eyes shows unless it is given another
+DEFAULT_FACE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "face.json")
+
+#glow settings a face may choose, named like the dynamic_eyes.main arguments they set the default of
+GLOW_SETTINGS = ("post", "blur", "blur_radius", "blur_strength", "bloom_levels", "bloom_factor")
+
+#settings of an eye and of the mouth, the first three of each are required
+EYE_KEYS = ("centre", "iris_color", "iris_radius", "pupil_color", "pupil_radius", "left_eye", "velocity")
+MOUTH_KEYS = ("centre", "color", "radius", "velocity")
+EYE_REQUIRED, MOUTH_REQUIRED = EYE_KEYS[:3], MOUTH_KEYS[:3]
+
+
+class FacePlan:
+    #What the frame loop needs of a face, made once at startup (see dynamic_eyes.compile_face): a FaceGroup of
+    #the sprites in the order they are drawn, with every frame they show already drawn, the sprites that take
+    #the expressions and the one that takes the miens, and the background they are drawn on
+    def __init__(self, eyes, mouth, background):
+        self.eyes = eyes
+        self.mouth = mouth
+        self.sprites = FaceGroup(*eyes, mouth)
+        self.background = background
+
+
+def load_face(path=DEFAULT_FACE):
+    #Read a face description from a .json or .toml file, see parse_face
+    with open(path, "rb") as file:
+        if path.endswith(".toml"):
+            if tomllib is None:
+                raise ValueError(f"Cannot read {path}: TOML faces need Python 3.11 or later")
+            description = tomllib.load(file)
+        else:
+            description = json.load(file)
+
+    try:
+        return parse_face(description)
+    except ValueError as error:
+        raise ValueError(f"Invalid face {path}: {error}") from None
+
+def parse_face(description):
+    #Check a face description and fill in what it leaves out. It has:
+    #   size        [width, height] the face is laid out for
+    #   colors      {name: [r, g, b]}, so colours elsewhere can be given by name
+    #   background  colour the face is drawn on, black by default (the sprite, temporal and analytic glows need black)
+    #   glow        default glow settings, see GLOW_SETTINGS
+    #   eyes        list of eyes, each with the Eye arguments in EYE_KEYS (at least those in EYE_REQUIRED)
+    #   mouth       the Mouth arguments in MOUTH_KEYS (at least those in MOUTH_REQUIRED)
+    #   expressions {expression: {"duration": seconds, "easing": name}}, overriding Eye.durations and Eye.easings;
+    #               easings are named as in animation.EASINGS
+    #   miens       the same for the mouth's miens
+    colors = description.get("colors", {})
+
+    def color(value):
+        if isinstance(value, str):
+            if value not in colors:
+                raise ValueError(f"unknown colour {value!r}")
+            value = colors[value]
+        if len(value) != 3:
+            raise ValueError(f"colour {value!r} is not [r, g, b]")
+        return tuple(value)
+
+    def sprite(values, keys, required, color_keys, what):
+        unknown = set(values) - set(keys)
+        if unknown:
+            raise ValueError(f"unknown {what} settings {sorted(unknown)}")
+        missing = [key for key in required if key not in values]
+        if missing:
+            raise ValueError(f"{what} without {', '.join(missing)}")
+        return {key: color(value) if key in color_keys else tuple(value) if key == "centre" else value for key, value in values.items()}
+
+    def timings(values, enum):
+        what = enum.__name__.lower()
+        for name, timing in values.items():
+            if not isinstance(name, str) or name.upper() not in enum.__members__:
+                raise ValueError(f"unknown {what} {name!r}")
+            if not isinstance(timing, dict):
+                raise ValueError(f"{what} {name} is not a table of duration and easing")
+            unknown = set(timing) - {"duration", "easing"}
+            if unknown:
+                raise ValueError(f"unknown {what} {name} settings {sorted(unknown)}")
+            duration = timing.get("duration", 0)
+            if isinstance(duration, bool) or not isinstance(duration, (int, float)) or not math.isfinite(duration) or duration < 0:
+                raise ValueError(f"{what} {name} duration {duration!r} is not a number of seconds")
+            if timing.get("easing", "linear") not in EASINGS:
+                raise ValueError(f"{what} {name} easing {timing['easing']!r} is not one of {', '.join(EASINGS)}")
+        return dict(values)
+
+    unknown = set(description.get("glow", {})) - set(GLOW_SETTINGS)
+    if unknown:
+        raise ValueError(f"unknown glow settings {sorted(unknown)}")
+    if "size" not in description or "mouth" not in description:
+        raise ValueError("a face needs a size and a mouth")
+
+    return {
+        "size": tuple(description["size"]),
+        "background": color(description.get("background", [0, 0, 0])),
+        "glow": dict(description.get("glow", {})),
+        "eyes": [sprite(eye, EYE_KEYS, EYE_REQUIRED, ("iris_color", "pupil_color"), "eye") for eye in description.get("eyes", [])],
+        "mouth": sprite(description["mouth"], MOUTH_KEYS, MOUTH_REQUIRED, ("color",), "mouth"),
+        "expressions": timings(description.get("expressions", {}), Expression),
+        "miens": timings(description.get("miens", {}), Mien),
+    }
@@ -1,35 +1,124 @@
-import numpy
+import zlib
+from collections import OrderedDict
+
 import cv2
 import pygame
 
-pygame.init()
-window = pygame.display.set_mode((300, 300))
-clock = pygame.time.Clock()
-
-def create_neon(surf):
-    surf_alpha = surf.convert_alpha()
-    rgb = pygame.surfarray.array3d(surf_alpha)
-    alpha = pygame.surfarray.array_alpha(surf_alpha).reshape((*rgb.shape[:2], 1))
-    image = numpy.concatenate((rgb, alpha), 2)
-    cv2.GaussianBlur(image, ksize=(9, 9), sigmaX=10, sigmaY=10, dst=image)
-    cv2.blur(image, ksize=(5, 5), dst=image)
-    bloom_surf = pygame.image.frombuffer(image.flatten(), image.shape[1::-1], 'RGBA')
+from post_processing import surface_view
+
+
+class NeonCache:
+    #Bounded LRU of neon glows keyed on a cheap hash of the source pixels, so a surface that has not
+    #changed since it was last glowed (the sheen, a resting eye) is only blurred once.
+    #It keeps at most `maxsize` glows and `maxbytes` of pixels (16MB: two 1080p glows, or many sprite-sized
+    #ones); a glow bigger than maxbytes on its own is not kept at all.
+    #The cached surfaces are shared between callers: copy one before drawing on it.
+    def __init__(self, maxsize=32, maxbytes=16 * 1024 * 1024):
+        self.maxsize = maxsize
+        self.maxbytes = maxbytes
+        self.hits = 0
+        self.misses = 0
+        self.nbytes = 0
+        self._glows = OrderedDict()
+
+    def __len__(self):
+        return len(self._glows)
+
+    @staticmethod
+    def _size(glow):
+        return glow.get_pitch() * glow.get_height()
+
+    @staticmethod
+    def key(surf, backend=None):
+        #crc32 straight off the pixel buffer (no copy) plus everything else that changes the glow
+        settings = None if backend is None else (backend.name, backend.radius, backend.strength)
+        return (surf.get_size(), surf.get_bitsize(), surf.get_masks(), surf.get_flags() & pygame.SRCALPHA, surf.get_colorkey(), settings, zlib.crc32(surf.get_buffer()))
+
+    def get(self, key):
+        glow = self._glows.get(key)
+        if glow is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self._glows.move_to_end(key)
+        return glow
+
+    def put(self, key, glow):
+        if self._size(glow) > self.maxbytes:
+            return
+
+        if key in self._glows:
+            self.nbytes -= self._size(self._glows[key])
+        self._glows[key] = glow
+        self._glows.move_to_end(key)
+        self.nbytes += self._size(glow)
+        while len(self._glows) > self.maxsize or self.nbytes > self.maxbytes:
+            _, evicted = self._glows.popitem(last=False)
+            self.nbytes -= self._size(evicted)
+
+    def clear(self):
+        self._glows.clear()
+        self.nbytes = 0
+
+
+#shared by every create_neon call that does not bring its own cache
+default_cache = NeonCache()
+
+
+def create_neon(surf, backend=None, cache=default_cache):
+    #backend: optional blur.BlurBackend to use instead of the default gaussian + box blur
+    #cache: NeonCache to look the glow up in and store it to, None to always blur
+    if cache is not None:
+        key = NeonCache.key(surf, backend)
+        glow = cache.get(key)
+        if glow is not None:
+            return glow
+
+    #the blur reads the source pixels in place and writes straight into the pixels of the glow surface
+    if surf.get_bytesize() == 4 and surf.get_flags() & pygame.SRCALPHA:
+        surf_alpha = surf
+    else:
+        surf_alpha = surf.convert_alpha()
+    bloom_surf = pygame.Surface(surf_alpha.get_size(), pygame.SRCALPHA, surf_alpha)
+
+    image = surface_view(surf_alpha)
+    bloom = surface_view(bloom_surf)
+    if backend is None:
+        cv2.GaussianBlur(image, ksize=(9, 9), sigmaX=10, sigmaY=10, dst=bloom)
+        cv2.blur(bloom, ksize=(5, 5), dst=bloom)
+    else:
+        backend.blur(image, bloom)
+    del image, bloom
+
+    if cache is not None:
+        cache.put(key, bloom_surf)
+
     return bloom_surf
 
-image = pygame.Surface((100, 100), pygame.SRCALPHA)
-pygame.draw.rect(image, (255, 128, 128), (10, 10, 80, 80))
-neon_image = create_neon(image)
 
-run = True
-while run:
-    for event in pygame.event.get():
-        if event.type == pygame.QUIT:
-            run = False          
+def main():
+    pygame.init()
+    window = pygame.display.set_mode((300, 300))
+    clock = pygame.time.Clock()
+
+    image = pygame.Surface((100, 100), pygame.SRCALPHA)
+    pygame.draw.rect(image, (255, 128, 128), (10, 10, 80, 80))
+    neon_image = create_neon(image)
+
+    run = True
+    while run:
+        for event in pygame.event.get():
+            if event.type == pygame.QUIT:
+                run = False
+
+        window.fill((127, 127, 127))
+        window.blit(neon_image, neon_image.get_rect(center = window.get_rect().center), special_flags = pygame.BLEND_PREMULTIPLIED)
+        pygame.display.flip()
+        clock.tick(60)
 
-    window.fill((127, 127, 127))
-    window.blit(neon_image, neon_image.get_rect(center = window.get_rect().center), special_flags = pygame.BLEND_PREMULTIPLIED)
-    pygame.display.flip()
-    clock.tick(60)
+    pygame.quit()
+    exit()
 
-pygame.quit()
-exit()
\ No newline at end of file
+if __name__ == "__main__":
+    main()
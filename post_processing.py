@@ -0,0 +1,452 @@
+import copy
+import math
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import cv2
+import pygame as pg
+
+from blur import GaussianBlur, Scratch, get_backend
+
+
+def surface_view(surface):
+    #Wrap the pixel memory of a 32-bit surface in a (height, width, 4) array without copying it.
+    #The surface stays locked for as long as the returned array (or any slice of it) is alive.
+    width, height = surface.get_size()
+    return np.ndarray((height, width, 4), np.uint8, surface.get_buffer(), strides=(surface.get_pitch(), 4, 1))
+
+
+def create_post_processor(post="blur", blur="gaussian", radius=16, strength=20, bloom_levels=3, bloom_factor=0.5, workers=1, opencv_threads=None,
+                          temporal=None, temporal_threshold=1):
+    #Build the post-processing stage from its settings; post=None turns the glow off.
+    #temporal: reuse the glow between frames, recomputing it at least every this many frames
+    if opencv_threads is not None:
+        cv2.setNumThreads(opencv_threads)
+
+    if post is None:
+        return None
+    if post == "bloom":
+        post_processor = BloomPostProcessor(levels=bloom_levels, factor=bloom_factor, radius=radius, strength=strength, backend=blur)
+    elif post == "blur" and workers > 1:
+        post_processor = TiledPostProcessor(get_backend(blur, radius=radius, strength=strength), workers=workers)
+    elif post == "blur":
+        post_processor = PostProcessor(get_backend(blur, radius=radius, strength=strength))
+    else:
+        raise ValueError(f"Unknown post-processing '{post}', expected 'blur', 'bloom' or None")
+
+    if temporal:
+        post_processor = TemporalPostProcessor(post_processor, threshold=temporal_threshold, refresh=temporal)
+
+    return post_processor
+
+
+def merge_rects(rects):
+    #Union overlapping rects until none overlap, so no pixel is processed twice
+    merged = []
+    for rect in rects:
+        rect = pg.Rect(rect)
+        overlapping = rect.collidelist(merged)
+        while overlapping != -1:
+            rect.union_ip(merged.pop(overlapping))
+            overlapping = rect.collidelist(merged)
+        merged.append(rect)
+
+    return merged
+
+
+def _region(rect):
+    #numpy index of a pygame rect in a [y, x] image
+    return np.s_[rect.top:rect.bottom, rect.left:rect.right]
+
+
+class PostProcessor:
+    #Persistent replacement for glassy_blur: all full-frame buffers are allocated once per display size
+    #and reused, so a running frame loop does no frame-sized allocation.
+
+    #how many frames old the surface returned by apply() is
+    latency_frames = 0
+
+    def __init__(self, backend=None):
+        #any blur.BlurBackend, the exact Gaussian glassy_blur uses by default
+        self.backend = backend if backend is not None else GaussianBlur(radius=16, strength=20)
+
+        self._size = None
+        self._surface = None
+        #scratch arrays, only used when the source surface is not 32 bits per pixel
+        self._src = None
+        self._dst = None
+        #areas processed on their own last frame with sprites, None when the whole result has to be reset
+        self._lit = None
+
+    @property
+    def reach(self):
+        #how far the glow spreads from a lit pixel; regions processed on their own need this much margin
+        return self.backend.reach
+
+    @property
+    def nbytes(self):
+        #memory held by the processor's buffers, in bytes
+        total = 0
+        if self._surface is not None:
+            total += self._surface.get_pitch() * self._surface.get_height()
+        if self._src is not None:
+            total += self._src.nbytes + self._dst.nbytes
+
+        return total
+
+    def resize(self, surface):
+        #(Re)allocate the buffers for the size and pixel format of the given surface
+        self._size = surface.get_size()
+        self._lit = None
+
+        #same pixel format as the source so channels line up byte for byte, no per-pixel alpha so the
+        #premultiplied blit behaves as it did with surfarray.make_surface
+        self._surface = pg.Surface(self._size, 0, surface)
+
+        if surface.get_bytesize() == 4:
+            self._src = None
+            self._dst = None
+        else:
+            self._src = np.empty((self._size[1], self._size[0], 3), np.uint8)
+            self._dst = np.empty_like(self._src)
+
+    def apply(self, surface, rects=None, sprites=None):
+        #Post-process the surface, or only the given rects of it, and return the reused result surface.
+        #With rects, only those regions of the result are valid; each is processed together with a
+        #margin of `reach` pixels so the glow crossing its edges is the same as for the full frame. The
+        #margins come out wrong (mirrored at the region's edge), so overlapping regions are merged into one
+        #rather than one region's margin overwriting the valid pixels of another.
+        #sprites: what was composited onto a surface that is a plain background everywhere else. A blurred
+        #background is the background, so only the area the sprites' glow reaches is processed (their merged
+        #rects plus `reach`, plus another `reach` so the region's mirrored edges only read background); the
+        #rest of the result is the background, copied from the surface where the last frame lit it.
+        if surface.get_size() != self._size:
+            self.resize(surface)
+
+        bounds = surface.get_rect()
+        #areas copied from the surface as they are, before the areas processed are written over them
+        reset = []
+        if rects is not None:
+            areas = merge_rects(rect.inflate(2 * self.reach, 2 * self.reach).clip(bounds) for rect in rects)
+            self._lit = None
+        elif sprites is not None:
+            areas = merge_rects(sprite.rect.inflate(4 * self.reach, 4 * self.reach).clip(bounds) for sprite in sprites)
+            reset = [bounds] if self._lit is None else self._lit
+            self._lit = areas
+        else:
+            areas = [bounds]
+            self._lit = None
+
+        if self._src is None:
+            #blur straight from the source's pixels into the reused surface's pixels
+            src = surface_view(surface)
+            dst = surface_view(self._surface)
+            for area in reset:
+                region = _region(area)
+                np.copyto(dst[region], src[region])
+            for area in areas:
+                region = _region(area)
+                self.process(src[region], dst[region])
+        else:
+            #pixels3d is indexed [x, y], transpose it to match the [y, x] layout of surface_view
+            pixels = pg.surfarray.pixels3d(surface).transpose(1, 0, 2)
+            for area in reset:
+                region = _region(area)
+                np.copyto(self._dst[region], pixels[region])
+            for area in areas:
+                region = _region(area)
+                np.copyto(self._src[region], pixels[region])
+                self.process(self._src[region], self._dst[region])
+            del pixels
+
+            pixels = pg.surfarray.pixels3d(self._surface).transpose(1, 0, 2)
+            for area in reset + areas:
+                region = _region(area)
+                np.copyto(pixels[region], self._dst[region])
+
+        #the views above are released on return, unlocking both surfaces for blitting
+        return self._surface
+
+    def process(self, src, dst):
+        #post-process one [y, x] image array into another of the same shape
+        self.backend.blur(src, dst)
+
+
+class TiledPostProcessor(PostProcessor):
+    #Splits the frame into horizontal bands and blurs them on a pool of worker threads (OpenCV releases
+    #the GIL). Each band is blurred together with `reach` rows above and below it, so the result matches
+    #the whole frame blurred at once; the extended band goes into the band's own scratch buffer and only
+    #the band's rows are copied to the output, so no two workers write the same pixels.
+    #OpenCV's own threading competes with the pool, so it is best limited to one thread per worker
+    #(create_post_processor's opencv_threads).
+    def __init__(self, backend=None, workers=4, min_band_rows=64):
+        super().__init__(backend)
+        self.workers = workers
+        self.min_band_rows = min_band_rows
+
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="glow")
+        #backends can keep scratch buffers, so every band gets its own copy
+        self._backends = [copy.deepcopy(self.backend) for _ in range(workers)]
+        #scratch buffer of each band's extended rows, reused whatever the source shape
+        self._scratch = [Scratch() for _ in range(workers)]
+
+    @property
+    def nbytes(self):
+        return super().nbytes + sum(scratch.nbytes for scratch in self._scratch)
+
+    def _bands(self, shape):
+        #(rows of the band, rows read around it) for each band, plus their scratch buffers
+        height = shape[0]
+        count = max(1, min(self.workers, height // self.min_band_rows))
+        edges = [round(i * height / count) for i in range(count + 1)]
+        reach = self.backend.reach
+
+        bands = []
+        for top, bottom, scratch in zip(edges, edges[1:], self._scratch):
+            extended = (max(top - reach, 0), min(bottom + reach, height))
+            bands.append(((top, bottom), extended, scratch.get((extended[1] - extended[0], *shape[1:]))))
+
+        return bands
+
+    def process(self, src, dst):
+        bands = self._bands(src.shape)
+        if len(bands) == 1:
+            self.backend.blur(src, dst)
+            return
+
+        def blur_band(i):
+            (top, bottom), (extended_top, extended_bottom), scratch = bands[i]
+            self._backends[i].blur(src[extended_top:extended_bottom], scratch)
+            np.copyto(dst[top:bottom], scratch[top - extended_top:bottom - extended_top])
+
+        for future in [self._pool.submit(blur_band, i) for i in range(len(bands))]:
+            future.result()
+
+    def close(self):
+        self._pool.shutdown()
+
+
+class BloomPostProcessor(PostProcessor):
+    #Mip-pyramid bloom: shrink the frame to a few small levels (1/2, 1/4, 1/8 by default), blur each one
+    #cheaply, then blend them back up to full size. Each level reproduces the glow of the full-resolution
+    #blur at its own scale, so the result looks like glassy_blur for a fraction of the convolution work.
+    def __init__(self, levels=3, factor=0.5, scales=None, weights=None, radius=16, strength=20, backend="gaussian"):
+        super().__init__(GaussianBlur(radius=radius, strength=strength))
+
+        #scale of each level relative to the frame, largest first
+        self.scales = tuple(sorted(scales, reverse=True)) if scales else tuple(factor ** (i + 1) for i in range(levels))
+        #how much each level contributes to the glow, equal by default
+        self.weights = tuple(weights) if weights else (1,) * len(self.scales)
+        if len(self.weights) != len(self.scales):
+            raise ValueError("BloomPostProcessor needs one weight per level")
+
+        #the level blurs are the full-resolution blur shrunk by the level's scale
+        self.level_backends = [get_backend(backend, radius=max(1, math.ceil(radius * scale)), strength=strength * scale) for scale in self.scales]
+
+        #pyramid buffers, reused whatever the source shape (the frame, or regions processed on their own):
+        #one scratch array per level plus one for a blurred copy of it
+        self._levels = [Scratch() for _ in self.scales]
+        self._blurred = [Scratch() for _ in self.scales]
+
+    @property
+    def reach(self):
+        #the level blurs reach further once scaled back up, plus a pixel or so of the resampling filters
+        return max(math.ceil((backend.reach + 2) / scale) for backend, scale in zip(self.level_backends, self.scales))
+
+    @property
+    def nbytes(self):
+        return super().nbytes + sum(scratch.nbytes for scratch in self._levels + self._blurred)
+
+    def _pyramid(self, shape):
+        height, width = shape[:2]
+        shapes = [(max(1, round(height * scale)), max(1, round(width * scale)), *shape[2:]) for scale in self.scales]
+
+        return [scratch.get(level) for scratch, level in zip(self._levels, shapes)], [scratch.get(level) for scratch, level in zip(self._blurred, shapes)]
+
+    def process(self, src, dst):
+        levels, blurred = self._pyramid(src.shape)
+
+        #downsample, each level from the one above it
+        previous = src
+        for level in levels:
+            cv2.resize(previous, level.shape[1::-1], dst=level, interpolation=cv2.INTER_AREA)
+            previous = level
+
+        for level, level_blurred, backend in zip(levels, blurred, self.level_backends):
+            backend.blur(level, level_blurred)
+
+        #upsample from the smallest level, blending each into the next so the weights are kept on the way up
+        combined = blurred[-1]
+        combined_weight = self.weights[-1]
+        for i in reversed(range(len(blurred) - 1)):
+            #the level is free once it has been blurred, so reuse it to hold the upsampled image
+            upsampled = levels[i]
+            cv2.resize(combined, upsampled.shape[1::-1], dst=upsampled, interpolation=cv2.INTER_LINEAR)
+
+            total = self.weights[i] + combined_weight
+            cv2.addWeighted(blurred[i], self.weights[i] / total, upsampled, combined_weight / total, 0, dst=blurred[i])
+            combined = blurred[i]
+            combined_weight = total
+
+        cv2.resize(combined, dst.shape[1::-1], dst=dst, interpolation=cv2.INTER_LINEAR)
+
+
+class SpriteGlow:
+    #Per-sprite alternative to post-processing the whole frame. The glow of a frame on black is the sum
+    #of the glows of the sprites on it, so each sprite frame is glowed once on its own padded surface and
+    #the renderer adds those together instead of blurring the screen: a resting face needs no convolution
+    #at all, and a new frame costs a blur the size of the sprite rather than of the screen.
+    #Glows are cached per frame surface (e.g. the frames of an animation.FrameCache), so frames must not be drawn on after they are glowed.
+    def __init__(self, post_processor=None):
+        #post_processor: the PostProcessor whose process() and reach make the glow, the default blur if None
+        self.post_processor = post_processor if post_processor is not None else PostProcessor()
+        #frame surface -> its glow, dropped along with the frame
+        self._glows = weakref.WeakKeyDictionary()
+
+    @property
+    def reach(self):
+        return self.post_processor.reach
+
+    @property
+    def nbytes(self):
+        return sum(glow.get_pitch() * glow.get_height() for glow in self._glows.values())
+
+    def __len__(self):
+        return len(self._glows)
+
+    def glow(self, image):
+        #the glow of a sprite frame, to be added to the screen at the frame's position moved by -reach
+        glow = self._glows.get(image)
+        if glow is None:
+            glow = self._glows[image] = self._render(image)
+
+        return glow
+
+    def _render(self, image):
+        reach = self.reach
+        width, height = image.get_size()
+        depth = image if image.get_bytesize() == 4 else 32
+
+        #the blurs mirror the image at its edges, so pad twice the reach to only ever mirror black
+        padded = pg.Surface((width + 4 * reach, height + 4 * reach), 0, depth)
+        padded.fill((0, 0, 0))
+        padded.blit(image, (2 * reach, 2 * reach))
+        blurred = pg.Surface(padded.get_size(), 0, padded)
+        self.post_processor.process(surface_view(padded), surface_view(blurred))
+
+        #nothing is lit further than the reach from the frame, so keep just that
+        return blurred.subsurface((reach, reach, width + 2 * reach, height + 2 * reach)).copy()
+
+
+class TemporalPostProcessor(PostProcessor):
+    #Reuses the previous frame's glow while the face barely moves, e.g. during the idle flicker.
+    #The frame is black apart from the sprites, so the glow of a sprite that moved a pixel is its previous
+    #glow moved by that pixel. apply() therefore only runs the wrapped post-processor when a sprite changed
+    #frame (frames are compared by identity, so they must not be drawn on in place), moved more than
+    #`threshold` pixels or near the screen edge, or `refresh` frames have passed. Otherwise it shifts each
+    #moved sprite's glow in the previous result and recomputes just the strips where two glows can meet.
+    #For the exact Gaussian this is exact, the approximations can drift a little, which the refresh bounds.
+    def __init__(self, post_processor=None, threshold=1, refresh=60):
+        self.post_processor = post_processor if post_processor is not None else PostProcessor()
+        super().__init__(self.post_processor.backend)
+        self.threshold = threshold
+        self.refresh = refresh
+
+        #frames whose glow was reused or recomputed, for tuning the threshold and refresh
+        self.reused = 0
+        self.recomputed = 0
+
+        #(frame surface, rect) of each sprite the current glow was made for
+        self._layout = None
+        self._age = 0
+
+    @property
+    def reach(self):
+        return self.post_processor.reach
+
+    @property
+    def nbytes(self):
+        return self.post_processor.nbytes
+
+    def process(self, src, dst):
+        self.post_processor.process(src, dst)
+
+    def apply(self, surface, rects=None, sprites=None):
+        if rects is not None or sprites is None:
+            #nothing to track (e.g. dirty rects, which only redo what changed anyway)
+            self._layout = None
+            return self.post_processor.apply(surface, rects)
+
+        layout = [(sprite.image, sprite.rect.copy()) for sprite in sprites]
+        areas = self._areas(surface, layout)
+        if areas is not None:
+            moved = [rect.topleft != previous.topleft for (_, previous), (_, rect) in zip(self._layout, layout)]
+            for (_, previous), (_, rect), sprite_moved in zip(self._layout, layout, moved):
+                if sprite_moved:
+                    self._shift(previous, rect)
+            self._repair(surface, areas, moved)
+            self._age += 1
+            self.reused += 1
+        else:
+            self._surface = self.post_processor.apply(surface)
+            self._age = 0
+            self.recomputed += 1
+
+        self._layout = layout
+        return self._surface
+
+    def _areas(self, surface, layout):
+        #the area each sprite's glow covers last frame and this one, None if the glow has to be recomputed
+        if self._surface is None or self._layout is None or len(layout) != len(self._layout) or self._age + 1 >= self.refresh:
+            return None
+        if surface.get_size() != self._surface.get_size() or surface.get_bytesize() != 4 or self._surface.get_bytesize() != 4:
+            return None
+
+        bounds = surface.get_rect()
+        areas = []
+        for (previous_image, previous), (image, rect) in zip(self._layout, layout):
+            if image is not previous_image:
+                return None
+            if abs(rect.x - previous.x) > self.threshold or abs(rect.y - previous.y) > self.threshold:
+                return None
+
+            #the glow only moves unchanged if none of it was cut off by the screen edge
+            area = previous.union(rect).inflate(2 * self.reach, 2 * self.reach)
+            if not bounds.contains(area):
+                return None
+            areas.append(area)
+
+        return areas
+
+    def _shift(self, previous, rect):
+        reach = self.reach
+        glow = self._surface.subsurface(previous.inflate(2 * reach, 2 * reach)).copy()
+        self._surface.fill((0, 0, 0), previous.inflate(2 * reach, 2 * reach))
+        self._surface.blit(glow, rect.inflate(2 * reach, 2 * reach))
+
+    def _repair(self, surface, areas, moved):
+        #A shift moves whatever lies in the sprite's area, so where another sprite's glow reaches into it (often
+        #only a corner) that light was moved or wiped too. Those strips, widened by how far the shifts can
+        #carry it, are recomputed from the frame with enough margin around them to come out exact.
+        bounds = surface.get_rect()
+        spread = len(areas) * self.threshold
+        reach = self.reach
+
+        src = surface_view(surface)
+        dst = surface_view(self._surface)
+        for i, area in enumerate(areas):
+            for j in range(i + 1, len(areas)):
+                overlap = area.clip(areas[j])
+                if not (moved[i] or moved[j]) or not (overlap.width and overlap.height):
+                    continue
+
+                overlap = overlap.inflate(2 * spread, 2 * spread).clip(bounds)
+                context = overlap.inflate(2 * reach, 2 * reach).clip(bounds)
+                blurred = np.empty((context.height, context.width, 4), np.uint8)
+                self.post_processor.process(src[_region(context)], blurred)
+                np.copyto(dst[_region(overlap)], blurred[_region(overlap.move(-context.x, -context.y))])
+
+    def close(self):
+        if hasattr(self.post_processor, "close"):
+            self.post_processor.close()
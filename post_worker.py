@@ -0,0 +1,191 @@
+import time
+import atexit
+import signal
+import logging
+import multiprocessing as mp
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from post_processing import PostProcessor, create_post_processor, merge_rects, surface_view
+from profiling import RollingHistogram
+
+logger = logging.getLogger(__name__)
+
+#longest the render loop waits for the worker before giving up on it
+TIMEOUT = 5.0
+
+
+def _worker(connection, names, shape, settings):
+    #Runs in the worker process: post-process whichever buffer pair the render loop hands over, answering with
+    #the slot and when it was done
+    #Ctrl-C reaches the whole process group; the render loop's close() stops the worker instead
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    buffers = [shared_memory.SharedMemory(name=name) for name in names]
+    try:
+        arrays = [np.ndarray(shape, np.uint8, buffer=buffer.buf) for buffer in buffers]
+        inputs, outputs = arrays[:2], arrays[2:]
+        post_processor = create_post_processor(**settings)
+
+        while True:
+            job = connection.recv()
+            if job is None:
+                break
+
+            slot, areas = job
+            for left, top, width, height in areas:
+                region = np.s_[top:top + height, left:left + width]
+                post_processor.process(inputs[slot][region], outputs[slot][region])
+            connection.send((slot, time.time()))
+
+        del inputs, outputs, arrays
+    finally:
+        for buffer in buffers:
+            buffer.close()
+
+
+class ProcessPostProcessor(PostProcessor):
+    #Moves the glow into a separate process so it runs alongside the render loop instead of after it.
+    #Frames travel through two pairs of shared-memory buffers (double buffering): while the worker
+    #blurs frame N from one pair, the loop composites frame N+1 and copies it into the other pair.
+    #apply() therefore returns the glow of the previous frame; the added latency is bounded to that one
+    #frame because apply() waits for the previous frame's result before handing over the next. How long
+    #the worker takes is recorded in `latency` (ms from handing a frame over to the worker finishing it,
+    #so a render loop that sleeps between frames does not count its sleep).
+    latency_frames = 1
+
+    def __init__(self, settings=None):
+        #settings: keyword arguments for create_post_processor, used to build the worker's post-processor
+        self.settings = dict(settings or {})
+        #the same post-processor in this process, for its reach and for process()
+        self._local = create_post_processor(**self.settings)
+        super().__init__(self._local.backend)
+
+        self.latency = RollingHistogram()
+
+        self._process_handle = None
+        self._connection = None
+        self._buffers = []
+        self._inputs = []
+        self._outputs = []
+        self._slot = 0
+        #(slot, areas, time handed over) of the frame the worker is busy with
+        self._in_flight = None
+        #when the worker finished the last frame collected from it
+        self._finished = None
+
+        #stop the worker and free the shared memory however the program ends
+        atexit.register(self.close)
+
+    @property
+    def reach(self):
+        return self._local.reach
+
+    @property
+    def nbytes(self):
+        return super().nbytes + sum(buffer.size for buffer in self._buffers)
+
+    def process(self, src, dst):
+        self._local.process(src, dst)
+
+    def resize(self, surface):
+        if surface.get_bytesize() != 4:
+            raise ValueError("ProcessPostProcessor needs a 32-bit surface")
+
+        self.close()
+        super().resize(surface)
+
+        width, height = self._size
+        shape = (height, width, 4)
+        self._buffers = [shared_memory.SharedMemory(create=True, size=height * width * 4) for _ in range(4)]
+        arrays = [np.ndarray(shape, np.uint8, buffer=buffer.buf) for buffer in self._buffers]
+        self._inputs, self._outputs = arrays[:2], arrays[2:]
+        for output in self._outputs:
+            output.fill(0)
+
+        #spawn rather than fork, so the worker does not inherit the display
+        context = mp.get_context("spawn")
+        self._connection, worker_connection = context.Pipe()
+        process_handle = context.Process(target=_worker, args=(worker_connection, [buffer.name for buffer in self._buffers], shape, self.settings), daemon=True, name="glow")
+        process_handle.start()
+        self._process_handle = process_handle
+
+    def apply(self, surface, rects=None, sprites=None):
+        #Hand this frame to the worker and return the glow of the previous one (black before the first)
+        if surface.get_size() != self._size:
+            self.resize(surface)
+
+        bounds = surface.get_rect()
+        if rects is None:
+            areas = [bounds]
+        else:
+            #merged like PostProcessor.apply, so no area's margin lands on another's valid pixels
+            areas = merge_rects(rect.inflate(2 * self.reach, 2 * self.reach).clip(bounds) for rect in rects)
+
+        slot = self._slot
+        src = surface_view(surface)
+        for area in areas:
+            region = np.s_[area.top:area.bottom, area.left:area.right]
+            np.copyto(self._inputs[slot][region], src[region])
+        del src
+
+        self._connection.send((slot, [tuple(area) for area in areas]))
+        #wall-clock time, which the worker's answer can be compared with
+        handed_over = time.time()
+
+        if self._in_flight is not None:
+            previous_slot, previous_areas, previous_handed_over = self._in_flight
+            done = self._collect(previous_slot)
+            #from when the worker had the frame and was free to start on it, so neither the worker starting up
+            #nor a frame it was still busy with count
+            if self._finished is not None:
+                self.latency.add(1000 * max(done - max(previous_handed_over, self._finished), 0))
+            self._finished = done
+
+            dst = surface_view(self._surface)
+            for area in previous_areas:
+                region = np.s_[area.top:area.bottom, area.left:area.right]
+                np.copyto(dst[region], self._outputs[previous_slot][region])
+            del dst
+
+        self._in_flight = (slot, areas, handed_over)
+        self._slot = 1 - slot
+
+        return self._surface
+
+    def _collect(self, slot):
+        #wait for the worker to finish the slot, returns when it did
+        if not self._connection.poll(TIMEOUT):
+            raise RuntimeError(f"Post-processing worker did not finish a frame within {TIMEOUT}s")
+
+        done, finished = self._connection.recv()
+        if done != slot:
+            raise RuntimeError(f"Post-processing worker finished buffer {done}, expected {slot}")
+
+        return finished
+
+    def close(self):
+        if self._process_handle is not None:
+            if self.latency:
+                logger.info("Off-process glow took %.2f ms from hand-over to result on average (p99 %.2f ms)", self.latency.mean, self.latency.percentile(99))
+
+            try:
+                if self._in_flight is not None:
+                    self._collect(self._in_flight[0])
+                self._connection.send(None)
+            except (OSError, RuntimeError):
+                pass
+            self._process_handle.join(TIMEOUT)
+            if self._process_handle.is_alive():
+                self._process_handle.terminate()
+            self._connection.close()
+            self._process_handle = None
+            self._in_flight = None
+            self._finished = None
+
+        self._inputs = []
+        self._outputs = []
+        for buffer in self._buffers:
+            buffer.close()
+            buffer.unlink()
+        self._buffers = []
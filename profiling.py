@@ -0,0 +1,115 @@
+import time
+from collections import deque
+
+import pygame as pg
+
+#Stages of a frame of the dynamic_eyes loop, in order
+STAGES = ("input", "update", "blit", "post-process", "present")
+
+
+class RollingHistogram:
+    #Histogram of the last `window` samples (in ms) with fixed-width bins, kept up to date as samples
+    #come and go so percentiles never need a sort. The last bin also holds everything past the range.
+    def __init__(self, window=240, bin_ms=0.25, bins=400):
+        self.bin_ms = bin_ms
+        self.counts = [0] * bins
+        self._samples = deque(maxlen=window)
+        self._total = 0.0
+
+    def __len__(self):
+        return len(self._samples)
+
+    def _bin(self, ms):
+        return min(int(ms / self.bin_ms), len(self.counts) - 1)
+
+    def add(self, ms):
+        if len(self._samples) == self._samples.maxlen:
+            evicted = self._samples[0]
+            self.counts[self._bin(evicted)] -= 1
+            self._total -= evicted
+
+        self._samples.append(ms)
+        self.counts[self._bin(ms)] += 1
+        self._total += ms
+
+    @property
+    def mean(self):
+        return self._total / len(self._samples) if self._samples else 0.0
+
+    def percentile(self, p):
+        #upper edge of the bin holding the p-th percentile; in the last bin, which has no upper edge, the
+        #largest sample in the window, so a percentile past the range is not reported as the range
+        target = p / 100 * len(self._samples)
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if count and seen >= target:
+                if i == len(self.counts) - 1:
+                    return max(self._samples)
+                return (i + 1) * self.bin_ms
+
+        return 0.0
+
+
+class FrameProfiler:
+    #Lightweight timers around the stages of the frame loop.
+    #Call start() at the top of every frame and mark(stage) as each stage ends; the time since the
+    #previous call goes to that stage's histogram. While disabled both return straight away.
+    def __init__(self, stages=STAGES, window=240, enabled=False):
+        self.enabled = enabled
+        self.stages = stages
+        self.histograms = {stage: RollingHistogram(window) for stage in stages}
+        #time between frame starts, i.e. 1/fps
+        self.frames = RollingHistogram(window, bin_ms=1, bins=200)
+
+        self._frame_start = None
+        self._last = None
+
+    def start(self):
+        if not self.enabled:
+            return
+
+        now = time.perf_counter()
+        if self._frame_start is not None:
+            self.frames.add(1000 * (now - self._frame_start))
+        self._frame_start = self._last = now
+
+    def mark(self, stage):
+        if not self.enabled:
+            return
+
+        now = time.perf_counter()
+        if self._last is not None:
+            self.histograms[stage].add(1000 * (now - self._last))
+        self._last = now
+
+    @property
+    def fps(self):
+        return 1000 / self.frames.mean if self.frames.mean else 0.0
+
+    def summary(self):
+        return {stage: {"mean": histogram.mean, "p50": histogram.percentile(50), "p99": histogram.percentile(99)} for stage, histogram in self.histograms.items()}
+
+
+class ProfilerOverlay:
+    #Small text panel with the FPS and the mean milliseconds of each stage, drawn on top of the
+    #presented frame. The text is only re-rendered every `refresh` frames.
+    def __init__(self, profiler, position=(10, 10), refresh=15, color=(255, 255, 255), background=(0, 0, 0)):
+        self.profiler = profiler
+        self.position = position
+        self.refresh = refresh
+        self.color = color
+        self.background = background
+
+        self._font = pg.font.Font(None, 28)
+        self._surface = None
+        self._frames = 0
+
+    def draw(self, surface):
+        #draw onto the surface and return the rect that was covered
+        if self._surface is None or self._frames % self.refresh == 0:
+            text = f"{self.profiler.fps:5.1f} fps  " + "  ".join(f"{stage} {histogram.mean:.2f}" for stage, histogram in self.profiler.histograms.items()) + " ms"
+            self._surface = self._font.render(text, True, self.color, self.background)
+        self._frames += 1
+
+        return surface.blit(self._surface, self.position)
@@ -0,0 +1,89 @@
+import logging
+from collections import deque
+
+from blur import BACKENDS
+from post_processing import create_post_processor
+
+logger = logging.getLogger(__name__)
+
+
+def quality_tiers(base):
+    #Glow settings from best to cheapest, in create_post_processor's terms, starting from the configured
+    #`base` and scaled with it. Going down the list first shrinks the blur kernel and sigma, then moves to
+    #a bloom pyramid at falling resolution (with the base's blur, or box blur where that is cheaper), and
+    #finally turns the glow off.
+    radius, strength = base.get("radius", 16), base.get("strength", 20)
+    #backends are registered best first, cheapest last
+    backends = list(BACKENDS)
+    blur = base.get("blur", "gaussian")
+    cheap_blur = max(blur, "box", key=backends.index)
+
+    return [
+        base,
+        {**base, "radius": max(round(radius * 10 / 16), 1), "strength": strength * 12 / 20},
+        {**base, "post": "bloom", "bloom_levels": 3, "bloom_factor": 0.5},
+        {**base, "post": "bloom", "blur": cheap_blur, "bloom_levels": 2, "bloom_factor": 0.25},
+        {"post": None},
+    ]
+
+
+QUALITY_TIERS = quality_tiers({"post": "blur", "blur": "gaussian", "radius": 16, "strength": 20})
+
+
+def describe(tier):
+    if tier["post"] is None:
+        return "no glow"
+    if tier["post"] == "bloom":
+        return f"{tier['blur']} bloom r={tier['radius']} sigma={tier['strength']:g} levels={tier['bloom_levels']}x{tier['bloom_factor']}"
+
+    return f"{tier['blur']} blur r={tier['radius']} sigma={tier['strength']:g}"
+
+
+class AdaptiveQuality:
+    #Keeps frames inside a time budget by stepping through quality tiers.
+    #The average of the last `window` frame times is compared with the budget: above it the quality
+    #drops a tier, below `headroom` times the budget it rises a tier. After any change both directions
+    #wait `cooldown` frames, so a tier that only just fits does not flicker between two settings.
+    def __init__(self, budget_ms=1000/60, tiers=QUALITY_TIERS, window=30, headroom=0.6, cooldown=120):
+        self.budget_ms = budget_ms
+        self.tiers = tiers
+        self.headroom = headroom
+        self.cooldown = cooldown
+
+        self.tier = 0
+        self._frame_times = deque(maxlen=window)
+        self._frames_since_change = 0
+        #post-processors are built the first time their tier is used and then kept with their buffers
+        self._post_processors = {}
+
+    @property
+    def post_processor(self):
+        if self.tier not in self._post_processors:
+            self._post_processors[self.tier] = create_post_processor(**self.tiers[self.tier])
+
+        return self._post_processors[self.tier]
+
+    def frame(self, frame_ms):
+        #Record how long a frame took; returns True when the quality tier changed
+        self._frame_times.append(frame_ms)
+        self._frames_since_change += 1
+        if self._frames_since_change < self.cooldown or len(self._frame_times) < self._frame_times.maxlen:
+            return False
+
+        average_ms = sum(self._frame_times) / len(self._frame_times)
+        if average_ms > self.budget_ms and self.tier < len(self.tiers) - 1:
+            self._change(self.tier + 1, average_ms)
+            return True
+        if average_ms < self.headroom * self.budget_ms and self.tier > 0:
+            self._change(self.tier - 1, average_ms)
+            return True
+
+        return False
+
+    def _change(self, tier, average_ms):
+        logger.info("Quality %s -> %s (average frame %.1f ms, budget %.1f ms)",
+                    describe(self.tiers[self.tier]), describe(self.tiers[tier]), average_ms, self.budget_ms)
+
+        self.tier = tier
+        self._frame_times.clear()
+        self._frames_since_change = 0
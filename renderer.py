@@ -0,0 +1,273 @@
+import math
+
+import pygame as pg
+
+from profiling import FrameProfiler
+from post_processing import SpriteGlow
+
+
+class FaceGroup(pg.sprite.LayeredUpdates):
+    #The sprites of the face in the order they are drawn (by layer, then by when they were added), like
+    #pg.sprite.LayeredDirty: they are drawn with one batched Surface.blits call rather than a blit each, and
+    #the group tracks which of them moved or flagged a new image (`dirty`, DirtySprite style: 1 until drawn,
+    #2 always), so it can tell the presenter which rects changed.
+    def __init__(self, *sprites):
+        super().__init__(*sprites)
+        #where each sprite was when changed_rects last looked
+        self._previous_rects = {}
+
+    def draw(self, surface, blit=None, clip=None):
+        #Draw the visible sprites, returns the rects drawn to. blit(sprite) gives the (source, dest[, area,
+        #special_flags]) to blit for a sprite, its image at its rect by default; with clip, only sprites whose
+        #blit reaches into that rect are drawn.
+        sequence = []
+        for sprite in self.sprites():
+            if not getattr(sprite, "visible", 1):
+                continue
+
+            args = blit(sprite) if blit is not None else (sprite.image, sprite.rect)
+            if clip is None or clip.colliderect((args[1][0], args[1][1], *args[0].get_size())):
+                sequence.append(args)
+
+        return surface.blits(sequence)
+
+    def changed_rects(self, bounds, margin=None, everything=False):
+        #The rects that changed since the last call: where each sprite that moved or is dirty was and is now,
+        #widened by margin(sprite) on every side and clipped to bounds. everything returns all of bounds.
+        rects = []
+        for sprite in self.sprites():
+            previous = self._previous_rects.get(sprite)
+            if sprite.dirty or previous != sprite.rect:
+                if not everything:
+                    reach = margin(sprite) if margin is not None else 0
+                    changed = sprite.rect if previous is None else sprite.rect.union(previous)
+                    changed = changed.inflate(2 * reach, 2 * reach).clip(bounds)
+                    if changed.width and changed.height:
+                        rects.append(changed)
+
+                self._previous_rects[sprite] = sprite.rect.copy()
+                if sprite.dirty == 1:
+                    sprite.dirty = 0
+
+        return [bounds] if everything else rects
+
+    def remove_internal(self, sprite):
+        super().remove_internal(sprite)
+        self._previous_rects.pop(sprite, None)
+
+
+class Renderer:
+    #Composites the face sprites, post-processes the result and presents it.
+    #With dirty_rects, only the regions whose sprites moved or were redrawn since the last frame (plus
+    #the margin their glow reaches) are cleared, re-composited, post-processed and presented.
+    #With sprite_glow, the post-processor glows each sprite frame once (see SpriteGlow) and those glows
+    #are added together instead of post-processing the composite every frame. Sprites that bring their own
+    #glows (a `glows` dict of frame -> glow reaching `glow_reach` past the frame, e.g. the analytic sdf.Glow)
+    #have those added instead, and need no post-processor at all.
+    #render() takes a FaceGroup, or a list of sprites that it keeps in one of its own.
+    #With a display, the frame is drawn into `screen` as an offscreen surface at its own (lower) resolution and
+    #smoothscaled onto the display to present it, keeping its aspect ratio.
+    #With skip_unchanged, a frame in which no sprite changed its image or moved is not drawn at all (dirty_rects
+    #skips those anyway), and `settled` tells the frame loop when it may sleep until something changes.
+    def __init__(self, screen, post_processor, background=(0, 0, 0), dirty_rects=False, profiler=None, sprite_glow=False, display=None, skip_unchanged=False):
+        #post_processor may be None to present the sharp composite without any glow
+        self.screen = screen
+        self.display = display
+        #where on the display the scaled frame goes
+        self._present_rect = self._fit(screen, display) if display is not None else None
+        self.background = background
+        self.dirty_rects = dirty_rects
+        self.sprite_glow = sprite_glow
+        self.post_processor = post_processor
+        self._glow = SpriteGlow(post_processor) if sprite_glow and post_processor is not None else None
+        #times the blit, post-process and present stages
+        self.profiler = profiler if profiler is not None else FrameProfiler()
+        #anything with a draw(surface) -> rect method, drawn over the presented frame
+        self.overlay = None
+        self._overlay_rect = None
+        #rects waiting for a post-processor that returns its results a frame late
+        self._delayed_rects = []
+
+        #sharp composite the glow is computed from; the screen only ever holds the post-processed image
+        self._scene = pg.Surface(screen.get_size(), 0, screen) if dirty_rects else None
+        #group kept for render() calls with a list of sprites
+        self._group = FaceGroup()
+        self._full_redraw = True
+
+        self.skip_unchanged = skip_unchanged
+        #(image, rect) of every sprite in the last frame drawn
+        self._previous_frame = None
+        #frames still to draw after the sprites stopped changing, for a post-processor that returns its results late
+        self._settling = 0
+
+    def set_post_processor(self, post_processor):
+        #swap the glow stage, e.g. for a different quality; the next frame is redrawn in full
+        self.post_processor = post_processor
+        self._glow = SpriteGlow(post_processor) if self.sprite_glow and post_processor is not None else None
+        self._full_redraw = True
+        self._delayed_rects = []
+
+    @property
+    def settled(self):
+        #whether everything drawn so far is on screen, so nothing changes until a sprite does
+        return self._settling == 0 and not self._delayed_rects
+
+    @property
+    def latency_frames(self):
+        #how many frames old the glow of a presented frame is
+        return self.post_processor.latency_frames if self.post_processor is not None and not self.sprite_glow else 0
+
+    def render(self, sprites):
+        #draw a frame, returns the rects that were presented (None for the whole screen, [] for none)
+        sprites = self._grouped(sprites)
+        if not self.dirty_rects:
+            if self.skip_unchanged and self._unchanged(sprites):
+                return []
+
+            self.screen.fill(self.background)
+
+            sprites.draw(self.screen, self._blit)
+            self.profiler.mark("blit")
+
+            #!Apply any post-processing to the entire display here:
+            if self.post_processor is not None and not self.sprite_glow:
+                blurred_screen = self.post_processor.apply(self.screen, sprites=sprites)
+                self.screen.blit(blurred_screen, blurred_screen.get_rect(center = self.screen.get_rect().center), special_flags = pg.BLEND_PREMULTIPLIED)
+            self.profiler.mark("post-process")
+
+            if self.overlay is not None:
+                self.overlay.draw(self.screen)
+
+            self._present()
+            self.profiler.mark("present")
+            return None
+
+        #the glow spreads this far outside a sprite, so changes there have to be redrawn too
+        rects = sprites.changed_rects(self.screen.get_rect(), self._reach, everything=self._full_redraw)
+        self._full_redraw = False
+        #whatever the overlay covered last frame has to be put back
+        if self._overlay_rect is not None:
+            rects.append(self._overlay_rect)
+            self._overlay_rect = None
+
+        delayed = self.post_processor is not None and not self.sprite_glow and self.post_processor.latency_frames > 0
+        if not rects and not self._delayed_rects and self.overlay is None:
+            return rects
+
+        for rect in rects:
+            self._scene.set_clip(rect)
+            self._scene.fill(self.background, rect)
+            sprites.draw(self._scene, self._blit, clip=rect)
+        self._scene.set_clip(None)
+        self.profiler.mark("blit")
+
+        if self.post_processor is None or self.sprite_glow:
+            blurred_scene = self._scene
+        elif rects or delayed:
+            blurred_scene = self.post_processor.apply(self._scene, rects)
+
+        #a late post-processor returns the previous frame's regions, so present those
+        if delayed:
+            rects, self._delayed_rects = self._delayed_rects, rects
+
+        for rect in rects:
+            self.screen.blit(blurred_scene, rect, rect)
+        self.profiler.mark("post-process")
+
+        if self.overlay is not None:
+            self._overlay_rect = self.overlay.draw(self.screen)
+            rects.append(self._overlay_rect)
+
+        self._present(rects)
+        self.profiler.mark("present")
+        return rects
+
+    def _grouped(self, sprites):
+        #sprites as a FaceGroup, reusing the renderer's own group while it is given the same list
+        if isinstance(sprites, FaceGroup):
+            return sprites
+
+        sprites = list(sprites)
+        if self._group.sprites() != sprites:
+            self._group.empty()
+            self._group.add(*sprites)
+        return self._group
+
+    def _unchanged(self, sprites):
+        #whether this frame would look like the last one drawn
+        frame = [(sprite.image, tuple(sprite.rect), getattr(sprite, "visible", 1)) for sprite in sprites]
+        unchanged = not self._full_redraw and self.overlay is None and frame == self._previous_frame
+        self._previous_frame = frame
+        self._full_redraw = False
+
+        if not unchanged:
+            self._settling = self.latency_frames
+        elif self._settling:
+            #draw the same frame again until the late post-processor has caught up with it
+            self._settling -= 1
+            return False
+
+        return unchanged
+
+    @staticmethod
+    def _fit(screen, display):
+        #the largest rect with the screen's aspect ratio that fits the display, centred on it
+        scale = min(display.get_width() / screen.get_width(), display.get_height() / screen.get_height())
+        rect = pg.Rect(0, 0, round(screen.get_width() * scale), round(screen.get_height() * scale))
+        rect.center = display.get_rect().center
+        return rect
+
+    def _present(self, rects=None):
+        #show the frame, or the rects of it that changed
+        if self.display is None:
+            if rects is None:
+                pg.display.update()
+            else:
+                pg.display.update(rects)
+            return
+
+        #one smoothscale of the whole frame; the changed rects are only where the display is updated
+        target = self._present_rect
+        pg.transform.smoothscale(self.screen, target.size, self.display.subsurface(target))
+        if rects is None:
+            pg.display.update(target)
+            return
+
+        scale_x, scale_y = target.width / self.screen.get_width(), target.height / self.screen.get_height()
+        updates = []
+        for rect in rects:
+            #widened by a pixel for the filter, which blends each pixel with its neighbours
+            left, top = math.floor(rect.left * scale_x) - 1, math.floor(rect.top * scale_y) - 1
+            right, bottom = math.ceil(rect.right * scale_x) + 1, math.ceil(rect.bottom * scale_y) + 1
+            updates.append(pg.Rect(target.x + left, target.y + top, right - left, bottom - top).clip(target))
+        pg.display.update(updates)
+
+    def _sprite_glow(self, sprite):
+        #the glow to add in place of the sprite's frame and how far it reaches past it, None to composite the frame
+        if not self.sprite_glow:
+            return None, 0
+
+        glows = getattr(sprite, "glows", None)
+        if glows is not None and sprite.image in glows:
+            return glows[sprite.image], sprite.glow_reach
+        if self._glow is not None:
+            return self._glow.glow(sprite.image), self._glow.reach
+
+        return None, 0
+
+    def _reach(self, sprite):
+        #how far past its rect a sprite lights the presented frame
+        if self.sprite_glow:
+            glows = getattr(sprite, "glows", None)
+            if glows is not None and sprite.image in glows:
+                return sprite.glow_reach
+
+        return 0 if self.post_processor is None else self.post_processor.reach
+
+    def _blit(self, sprite):
+        #what to blit for a sprite (see FaceGroup.draw): its frame, or its glow to add
+        glow, reach = self._sprite_glow(sprite)
+        if glow is None:
+            return (sprite.image, sprite.rect)
+
+        return (glow, sprite.rect.move(-reach, -reach), None, pg.BLEND_ADD)
@@ -0,0 +1,112 @@
+import math
+
+import numpy as np
+import pygame as pg
+
+#coordinate grids per image radius and padding, shared by every sprite of that size
+_grids = {}
+
+
+def coverage(distance):
+    #How much of each pixel a shape covers, from the signed distance of the pixel's centre to the shape's edge
+    #(negative inside): 1 a half pixel inside the edge, 0 a half pixel outside, linear in between
+    return np.clip(0.5 - distance, 0, 1)
+
+
+def grids(radius, pad=0):
+    #x, y and distance from the centre of every pixel centre in a 2*radius square, indexed [x, y] like surfarray.
+    #With pad, the square is widened by that many pixels on every side, keeping the square's own coordinates.
+    if (radius, pad) not in _grids:
+        centres = np.arange(-pad, 2 * radius + pad, dtype=np.float32) + 0.5
+        x, y = np.meshgrid(centres, centres, indexing="ij")
+        _grids[radius, pad] = (x, y, np.hypot(x - radius, y - radius))
+
+    return _grids[radius, pad]
+
+
+def below_line(x, y, width, left, right):
+    #Signed distance below the line from height `left` at x=0 to `right` at x=width, measured across the line
+    #rather than straight down so slanted edges blend as evenly as flat ones
+    return (y - left - (right - left) * x / width) * (width / np.hypot(width, right - left))
+
+
+class EyeShapes:
+    #Draws the eye from signed distance fields instead of rasterising it: the iris and pupil are circles
+    #around the centre, so their distance fields come from one cached distance-from-centre grid, and an
+    #eyelid is a half-plane above a line across the eye. Each shape becomes an anti-aliased coverage mask in
+    #a few vectorised operations, and the eye is written straight into a per-pixel alpha surface.
+    def __init__(self, radius):
+        self.radius = radius
+        self.x, self.y, self.distance = grids(radius)
+        #(packed colour, iris alpha) of the open eye, per iris colour, pupil colour, pupil radius and pixel format
+        self._open = {}
+
+    def lid(self, left, right):
+        #coverage of an eyelid whose lower edge runs from height `left` at the left of the eye to `right` at the right
+        return coverage(below_line(self.x, self.y, 2 * self.radius, left, right))
+
+    def open_eye(self, iris_color, pupil_color, pupil_radius, shifts=(16, 8, 0, 24)):
+        #The colour of every pixel of the eye without a lid, packed into 32-bit pixels with the given channel
+        #shifts, and the alpha of the iris; made once, as only the lid changes between frames
+        key = (tuple(iris_color[:3]), tuple(pupil_color[:3]), pupil_radius, tuple(shifts))
+        if key not in self._open:
+            pupil = coverage(self.distance - pupil_radius)
+            iris_color = np.asarray(iris_color[:3], np.float32)
+            pupil_color = np.asarray(pupil_color[:3], np.float32)
+            color = (iris_color + (pupil_color - iris_color) * pupil[..., np.newaxis] + 0.5).astype(np.uint32)
+            packed = (color[..., 0] << shifts[0]) | (color[..., 1] << shifts[1]) | (color[..., 2] << shifts[2])
+
+            self._open[key] = (packed, 255 * coverage(self.distance - self.radius) + 0.5)
+
+        return self._open[key]
+
+    def render(self, surface, iris_color, pupil_color, pupil_radius, lid=None):
+        #Draw onto a 2*radius square 32-bit SRCALPHA surface; lid is an optional (left, right) eyelid, see lid()
+        shifts = surface.get_shifts()
+        color, iris = self.open_eye(iris_color, pupil_color, pupil_radius, shifts)
+        alpha = iris if lid is None else iris * (1 - self.lid(*lid))
+
+        #whole pixels at once, colour and alpha together
+        pg.surfarray.pixels2d(surface)[...] = color | (alpha.astype(np.uint32) << shifts[3])
+
+
+class Glow:
+    #Analytic glow of the shapes in a 2*radius square sprite: instead of blurring the drawn shape, the glow
+    #falls off with the distance d outside it as exp(-d²/sigma²), which needs nothing but the shape's distance
+    #field on a grid padded by the reach of the falloff. The shape itself (d <= 0) comes out at full colour,
+    #so the result is the lit shape and its halo in one pass, ready to be added to a black frame.
+    def __init__(self, radius, sigma):
+        self.radius = radius
+        self.sigma = sigma
+        #past this the halo is below half a level out of 255
+        self.reach = math.ceil(sigma * math.sqrt(math.log(2 * 255)))
+        self.x, self.y, self.distance = grids(radius, self.reach)
+
+    def circle(self, radius):
+        #distance outside a circle around the centre of the sprite
+        return self.distance - radius
+
+    def below(self, left, right):
+        #distance outside the part of the sprite below a line, like an eyelid's lower edge (see below_line)
+        return -below_line(self.x, self.y, 2 * self.radius, left, right)
+
+    def band(self, half_height):
+        #distance outside a horizontal band across the full width of the sprite, through its centre
+        qx = np.abs(self.x - self.radius) - self.radius
+        qy = np.abs(self.y - self.radius) - half_height
+        return np.hypot(np.maximum(qx, 0), np.maximum(qy, 0)) + np.minimum(np.maximum(qx, qy), 0)
+
+    def disc(self, outer_color, inner_color, radius):
+        #[x, y] colours of a disc of inner_color on outer_color around the centre, like the pupil in the iris
+        inner = coverage(self.circle(radius))[..., np.newaxis]
+        outer_color = np.asarray(outer_color[:3], np.float32)
+        return outer_color + (np.asarray(inner_color[:3], np.float32) - outer_color) * inner
+
+    def render(self, distance, color):
+        #The glow of the shape with this distance field, as a surface (2*radius + 2*reach square) to add at
+        #the sprite's position moved by -reach. color is one colour or an [x, y] array of them.
+        intensity = np.exp(-np.square(np.maximum(distance, 0) / self.sigma))
+        glow = pg.Surface(distance.shape)
+        pg.surfarray.pixels3d(glow)[...] = np.asarray(color, np.float32) * intensity[..., np.newaxis] + 0.5
+
+        return glow